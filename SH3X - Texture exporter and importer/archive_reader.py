@@ -0,0 +1,101 @@
+import mmap
+import os
+import threading
+
+# Read-only access to archive files.
+# With use_mmap the archive is memory-mapped and every header or payload is
+# handed out as a memoryview slice of the mapping, so nothing is copied until
+# a texture is actually decoded. Without it the whole file is read into memory
+# once, the way the extractors have always worked.
+# A closed reader opens the file again on the next access, so textures that
+# still refer to it keep working, while the file is not held open (which on
+# Windows would block patching it) between uses.
+
+
+class ArchiveReader:
+    def __init__(self, filename, use_mmap=True):
+        self.filename = filename
+        self.use_mmap = use_mmap
+        self.size = os.path.getsize(filename)
+        self._mmap = None
+        self._buffer = None
+        self._view = None
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        with open(self.filename, "rb") as f:
+            if self.use_mmap and self.size > 0:
+                # The mapping stays valid after the file handle is closed
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._buffer = self._mmap
+            else:
+                self._buffer = f.read()
+        self._view = memoryview(self._buffer)
+
+    @property
+    def closed(self):
+        return self._view is None
+
+    def _opened_view(self):
+        # Opens the file again if the reader was closed (once, even if several threads ask at once)
+        view = self._view
+        if view is None:
+            with self._lock:
+                if self._view is None:
+                    self._open()
+                view = self._view
+        return view
+
+    @property
+    def buffer(self):
+        return self._opened_view().obj
+
+    def find(self, pattern, start=0, end=None):
+        """
+        Returns the offset of the next occurrence of pattern, or -1.
+        """
+        if end is None:
+            end = self.size
+        return self.buffer.find(pattern, start, end)
+
+    def view(self, offset, size):
+        """
+        Returns a zero-copy memoryview of size bytes at offset (shorter at the end of the file).
+        """
+        return self._opened_view()[offset:offset + size]
+
+    def read(self, offset, size):
+        """
+        Returns a copy of size bytes at offset.
+        """
+        return bytes(self.view(offset, size))
+
+    def close(self):
+        """
+        Releases the mapping (or the file's contents). Views handed out earlier
+        must not be used afterwards; if any are still alive the mapping is left
+        for the garbage collector. The file is opened again if the reader is
+        used after closing.
+        """
+        with self._lock:
+            view, self._view = self._view, None
+        if view is None:
+            return
+        try:
+            view.release()
+        except BufferError:
+            pass
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
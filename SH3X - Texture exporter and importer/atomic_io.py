@@ -0,0 +1,58 @@
+import io
+import json
+import os
+import threading
+
+import profiling
+
+# Atomic output files.
+# Everything is written to a temporary file next to the target and renamed
+# over it once complete, so an interrupted run never leaves a half-written
+# file behind that a resumed run would take for finished output.
+
+
+def temp_path_for(path):
+    # The pid and thread keep workers (processes, or threads such as the
+    # thumbnail loaders) writing the same file apart
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _replace(temp_path, path):
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+def _write(path, data):
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+    except BaseException:
+        # A failed or interrupted write must not leave its temp file behind
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _replace(temp_path, path)
+
+
+def atomic_write_bytes(path, data):
+    with profiling.stage("write", bytes_written=len(data)):
+        _write(path, data)
+
+
+def atomic_write_json(path, obj, indent=None):
+    # Serialized in memory first, so an object that fails to serialize leaves no temp file behind
+    _write(path, json.dumps(obj, indent=indent).encode())
+
+
+def atomic_save_image(img, path, format="PNG", **params):
+    # Encoding in memory first keeps a failed encode from leaving a temp file behind
+    buffer = io.BytesIO()
+    with profiling.stage("encode"):
+        img.save(buffer, format=format, **params)
+    data = buffer.getbuffer()
+    profiling.count("encode", bytes_encoded=len(data))
+    atomic_write_bytes(path, data)
@@ -0,0 +1,64 @@
+import threading
+
+# Runs a texture iterator on a background thread.
+# The textures list grows as the scan finds textures, so a viewer can show
+# the first ones while the rest of the archive is still being scanned. The
+# window showing them calls close() when it goes away, which stops the scan
+# and closes the archives the textures read from.
+
+
+class BackgroundScan:
+    def __init__(self, texture_iter):
+        self.textures = []
+        self.done = False
+        self.error = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, args=(texture_iter,), daemon=True)
+        self._thread.start()
+
+    def _run(self, texture_iter):
+        try:
+            for texture in texture_iter:
+                if self._closed:
+                    break
+                self.textures.append(texture)
+        except Exception as e:
+            self.error = e
+        finally:
+            # Closing a generator runs its cleanup, which closes the archive it was scanning
+            close = getattr(texture_iter, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                self.done = True
+                closed = self._closed
+            if closed:
+                self._close_archives()
+
+    def _close_archives(self):
+        for texture in self.textures:
+            texture.close_archive()
+
+    def close(self):
+        """
+        Stops the scan and closes the archives of the textures found so far.
+        Textures accessed afterwards open their archive again.
+        """
+        with self._lock:
+            self._closed = True
+            if not self.done:
+                # The scan thread closes them once it stops
+                return
+        self._close_archives()
+
+    def status(self):
+        """
+        Returns a short description of the scan progress, for status labels.
+        """
+        count = len(self.textures)
+        if self.error is not None:
+            return f"{count} textures (scan stopped: {self.error})"
+        if not self.done:
+            return f"{count} textures found so far (scanning...)"
+        return f"{count} textures"
@@ -3,132 +3,84 @@
 import os
 import struct
 import logging
+import ps2_mode
+import profiling
+from checkpoint import Checkpoint
+from texture_index import archive_key
 
 # Configure logging
 logging.basicConfig(filename='analysis.log', level=logging.INFO, format='%(message)s')
 
-def analyze_textures(filename):
+# Texture fields written to the analysis log
+LOGGED_FIELDS = (
+    "index", "width", "height", "bpp", "data_size", "offset", "bypp", "entry_size",
+    "palette_header_info", "total_size", "filename",
+)
+
+def _analyze(filename, use_index=True):
+    with profiling.stage("analyze"):
+        textures = _log_textures(filename, use_index)
+    profiling.count("analyze", textures_logged=len(textures))
+    return textures
+
+
+def _log_textures(filename, use_index):
     textures = []
+    # Scan the file for texture headers (or load the cached index)
+    for texture in ps2_mode.iter_textures([filename], use_index):
+        # print the texture header values and offset
+        print(f"  Width: {texture.width}")
+        print(f"  Height: {texture.height}")
+        print(f"  bpp: {texture.bpp}")
+        print(f"  Data size: {texture.data_size}")
+        print(f"  Total size: {texture.total_size}")
+        print(f"  Palette Offset: {texture.palette_header_offset:#x}")
+        # print the palette header values
+        print (f" palette data size: {texture.palette_data_size}")
+        print(f"  entry_size: {texture.entry_size}")
+        print (f" bypp: {texture.bypp}")
+
+        # Format the texture information as a string
+        texture_info = "\n".join(f"{key}: {texture[key]}" for key in LOGGED_FIELDS)
+
+        # Log the texture information
+        logging.info(f"Texture information for file {filename}:\n{texture_info}\n")
+
+        # Add the texture to the list of textures
+        textures.append(texture)
+    return textures
+
+
+def analyze_textures(filename, use_index=True):
     try:
-        with open(filename, "rb") as f:
-            # Search for the texture header pattern
-            texture_header_pattern = b"\xFF\xFF\xFF\xFF\x00\x00\x00\x00\x00"
-            data = f.read()
-            texture_header_offset = data.find(texture_header_pattern)
-            while texture_header_offset != -1:
-                # Seek to the texture header
-                f.seek(texture_header_offset)
-                # Read the texture header
-                texture_header = f.read(0x20)
-                # Check the pattern to determine the header size
-                if texture_header[12:16] == b"\x20\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x08\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x20\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x08\x20\x00\x00":
-                    header_size = 80
-                elif texture_header[12:16] == b"\x04\x20\x00\x00":
-                    header_size = 112
-                else:
-                    header_size = 80
-                # Calculate the offset of the texture header
-                header_offset = f.tell() - 0x20
-                # Read the remaining bytes of the texture header
-                texture_header += f.read(header_size - 0x20)
-    
-                # print the texture header values and offset
-                print(f"  Width: {struct.unpack('<H', texture_header[8:10])[0]}")
-                print(f"  Height: {struct.unpack('<H', texture_header[10:12])[0]}")
-                print(f"  bpp: {struct.unpack('<B', texture_header[12:13])[0]}")
-                print(f"  Data size: {struct.unpack('<I', texture_header[16:20])[0]}")
-                print(f"  Total size: {struct.unpack('<I', texture_header[20:24])[0]}")
-    
-                # Parse the values from the texture header
-                width = struct.unpack("<H", texture_header[8:10])[0]
-                height = struct.unpack("<H", texture_header[10:12])[0]
-                bpp = struct.unpack("<B", texture_header[12:13])[0]
-                data_size = struct.unpack("<I", texture_header[16:20])[0]
-                total_size = struct.unpack("<I", texture_header[20:24])[0]
-                data_offset = struct.unpack("<I", texture_header[4:8])[0]
-    
-                # Read the texture data
-                texture_data_offset = f.tell()
-                f.seek(texture_data_offset)
-                texture_data = f.read(data_size)
-                # Read the palette header
-                palette_header_offset = texture_data_offset + data_size - (0x20 if header_size == 112 else 0)
-                f.seek(palette_header_offset)
-                palette_header = f.read(0x30)
-                print(f"  Palette Offset: {palette_header_offset:#x}")
-                # Extract relevant values from the palette header
-                palette_data_size = struct.unpack("<I", palette_header[0:4])[0]
-                bypp = struct.unpack("<B", palette_header[12:13])[0]
-                entry_size = struct.unpack("<B", palette_header[14:15])[0]
-                # print the palette header values
-                print (f" palette data size: {struct.unpack('<I', palette_header[0:4])[0]}")
-                print(f"  entry_size: {entry_size}")
-                print (f" bypp: {struct.unpack('<B', palette_header[12:13])[0]}")
-                # Read the palette data
-                palette_data_offset = palette_header_offset + 0x30
-                f.seek(palette_data_offset)
-                palette_data = f.read(palette_data_size)
-    
-    
-                # Move the file pointer to the start of the next texture header
-                f.seek(palette_data_offset + palette_data_size)
-                # Add the texture information to the list of textures
-                texture = {
-                    "index": len(textures),
-                    "width": width,
-                    "height": height,
-                    "bpp": bpp,
-                    "data_size": data_size,
-                    "offset": texture_data_offset,
-                    "bypp": bypp,
-                    "entry_size": entry_size,
-                    "palette_header_info": (palette_data_size, bypp),
-                    "total_size": total_size,
-                    "filename": f"texture_{texture_data_offset:x}.bin".replace(":", "_")
-                }
-                
-                # Format the texture information as a string
-                texture_info = "\n".join(f"{key}: {value}" for key, value in texture.items())
-                
-                # Log the texture information
-                logging.info(f"Texture information for file {filename}:\n{texture_info}\n")
-                
-                # Add the texture to the list of textures
-                textures.append(texture)
-                
-                # Update texture_header_offset to the next occurrence of texture_header_pattern
-                texture_header_offset = data.find(texture_header_pattern, texture_header_offset + 1)
-                
-                
-                # Format the texture information as a string
-                texture_info = "\n".join(f"{key}: {value}" for key, value in texture.items())
-                
-                # Log the texture information
-                logging.info(f"Texture information for file {filename}:\n{texture_info}\n")
-                
-                # Add the texture to the list of textures
-                textures.append(texture)
-                
+        return _analyze(filename, use_index)
     except Exception as e:
         print(f"An error occurred while analyzing {filename}: {str(e)}")
-    return textures
-            
-def batch_analyze(filenames):
+    return []
+
+
+def batch_analyze(filenames, checkpoint_path=None):
+    """
+    Analyzes every file and returns all of their textures. With checkpoint_path
+    each analyzed file is recorded there, and files that are unchanged since
+    they were analyzed are not logged again on a rerun.
+    """
+    checkpoint = Checkpoint(checkpoint_path, "analyze") if checkpoint_path is not None else None
     all_textures = []
     for filename in filenames:
         try:
-            textures = analyze_textures(filename)
+            if checkpoint is not None:
+                key = archive_key(filename)
+                if checkpoint.is_current(os.path.abspath(filename), key):
+                    # Already analyzed: take the textures from the index without logging them again
+                    all_textures.extend(ps2_mode.iter_textures([filename]))
+                    continue
+            textures = _analyze(filename)
             all_textures.extend(textures)
+            if checkpoint is not None:
+                checkpoint.mark(os.path.abspath(filename), key)
         except Exception as e:
             logging.error(f"An error occurred while analyzing {filename}: {str(e)}")
+    if checkpoint is not None:
+        checkpoint.close()
     return all_textures
@@ -0,0 +1,369 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import shutil
+import time
+
+import profiling
+import ps2_mode
+import texture_extraction
+from atomic_io import atomic_write_json, temp_path_for
+from checkpoint import Checkpoint
+from parallel_export import iter_jobs
+from texture_index import archive_key
+
+# Headless batch export of whole game installs.
+# Archives are found from directories or glob patterns and exported to PNG by
+# a process pool, one archive per job. The biggest archives are scheduled
+# first so a large archive doesn't start last and hold up the whole batch.
+# Each archive's output directory gets an export_summary.json, and the batch
+# summary (with throughput figures) is written to the output root.
+#
+# Exports are resumable: every archive's output directory has a checkpoint
+# journal recording each exported texture, so an interrupted batch picks up
+# where it stopped. Archives and textures whose inputs and output files are
+# unchanged are skipped.
+#
+# In dedup mode every texture is keyed by a hash of its content, each unique
+# texture is decoded and encoded once into <output root>/unique, and
+# dedup_manifest.json maps every (archive, offset) to its unique image.
+# Optionally the per-archive paths are filled with hardlinks to the unique files.
+#
+# With --profile the batch is profiled stage by stage (see profiling) and the
+# report is written to profile.json in the output root.
+
+SUMMARY_NAME = "export_summary.json"
+BATCH_SUMMARY_NAME = "batch_summary.json"
+CHECKPOINT_NAME = ".export_checkpoint.jsonl"
+UNIQUE_DIR_NAME = "unique"
+DEDUP_MANIFEST_NAME = "dedup_manifest.json"
+DEDUP_MANIFEST_VERSION = 1
+PROFILE_NAME = "profile.json"
+
+
+def find_archives(paths, pattern="*.arc"):
+    """
+    Expands directories (searched recursively for pattern), glob patterns and
+    plain file names into a list of archive paths, biggest first.
+    """
+    archives = set()
+    for path in paths:
+        if os.path.isdir(path):
+            archives.update(glob.glob(os.path.join(glob.escape(path), "**", pattern), recursive=True))
+        elif glob.has_magic(path):
+            archives.update(glob.glob(path, recursive=True))
+        else:
+            archives.add(path)
+    archives = [os.path.abspath(archive) for archive in archives if os.path.isfile(archive)]
+    return sorted(archives, key=lambda archive: (-os.path.getsize(archive), archive))
+
+
+def output_dirs(archives, output_root):
+    """
+    Maps each archive to <output_root>/<path relative to the common parent>_textures,
+    so archives with the same name in different folders don't collide.
+    """
+    if not archives:
+        return {}
+    common = os.path.commonpath([os.path.dirname(archive) for archive in archives])
+    return {
+        archive: os.path.join(output_root, os.path.splitext(os.path.relpath(archive, common))[0] + "_textures")
+        for archive in archives
+    }
+
+
+def write_summary(path, summary):
+    atomic_write_json(path, summary, indent=1)
+
+
+def texture_inputs(texture):
+    """
+    Returns what a texture's exported files are made from: its location and
+    content key (format, payload and palette).
+    """
+    return {"offset": texture.offset, "key": texture.content_key()}
+
+
+def texture_outputs(texture, output_dir, kind):
+    if kind == "ps2":
+        return [ps2_mode.raw_path(texture.filename, output_dir), ps2_mode.png_path(texture.filename, output_dir)]
+    return [texture_extraction.png_path(texture.filename, output_dir)]
+
+
+def load_summary(output_dir):
+    try:
+        with open(os.path.join(output_dir, SUMMARY_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def iter_archive_textures(filename, kind, use_index=True):
+    if kind == "ps2":
+        return ps2_mode.iter_textures([filename], use_index)
+    return texture_extraction.iter_textures(filename, use_index=use_index)
+
+
+def export_archive(job):
+    """
+    Exports every texture of one archive to PNG. Runs in a worker process and
+    returns the archive's summary. With resume, textures (or the whole archive)
+    recorded in the checkpoint as exported from the same data are skipped.
+    """
+    filename, output_dir, kind, use_index, resume = job
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    key = archive_key(filename)
+    checkpoint = Checkpoint(os.path.join(output_dir, CHECKPOINT_NAME), f"export-{kind}")
+    previous = load_summary(output_dir)
+    if resume and previous is not None and checkpoint.is_complete(key):
+        previous.update(resumed=True, exported=0, skipped=previous["textures"], seconds=time.perf_counter() - start)
+        return previous
+
+    textures = list(iter_archive_textures(filename, kind, use_index))
+
+    inputs = {}
+    pending = []
+    for texture in textures:
+        inputs[texture.filename] = texture_inputs(texture)
+        if not (resume and checkpoint.is_current(texture.filename, inputs[texture.filename])):
+            pending.append(texture)
+
+    def on_done(texture, error):
+        # Record each texture as soon as its files are written
+        if error is None:
+            checkpoint.mark(texture.filename, inputs[texture.filename], texture_outputs(texture, output_dir, kind))
+
+    with checkpoint:
+        if kind == "ps2":
+            failures = ps2_mode.unswizzle_and_save(pending, output_dir, progress=on_done)
+        else:
+            failures = texture_extraction.convert_textures_to_png(pending, output_dir, progress=on_done)
+        if not failures:
+            checkpoint.finish(key)
+
+    summary = {
+        "archive": filename,
+        "kind": kind,
+        "output_dir": output_dir,
+        "size": key["size"],
+        "textures": len(textures),
+        # exported + skipped + failed == textures
+        "exported": len(pending) - len(failures),
+        "skipped": len(textures) - len(pending),
+        "failed": [{"texture": name, "error": error.splitlines()[0]} for name, error in failures],
+        "seconds": time.perf_counter() - start,
+    }
+    write_summary(os.path.join(output_dir, SUMMARY_NAME), summary)
+    return summary
+
+
+def batch_export(archives, output_root, kind="pc", workers=0, use_index=True, resume=True):
+    """
+    Exports the archives to output_root with a process pool (0 = one worker
+    per core) and returns the batch summary. The batch summary is rewritten
+    as each archive completes. Without resume everything is exported again.
+    """
+    start = time.perf_counter()
+    dirs = output_dirs(archives, output_root)
+    jobs = [(archive, dirs[archive], kind, use_index, resume) for archive in archives]
+    os.makedirs(output_root, exist_ok=True)
+
+    results = []
+    for archive, (summary, error) in zip(archives, iter_jobs(export_archive, jobs, workers)):
+        if error is not None:
+            summary = {"archive": archive, "kind": kind, "size": os.path.getsize(archive),
+                       "textures": 0, "exported": 0, "skipped": 0, "error": error.splitlines()[0]}
+            print(f"Failed to export {archive}: {summary['error']}")
+        else:
+            print(f"{archive}: {summary['exported']}/{summary['textures']} textures "
+                  f"({summary['skipped']} unchanged) in {summary['seconds']:.2f}s")
+        results.append(summary)
+        batch = batch_summary(results, time.perf_counter() - start)
+        write_summary(os.path.join(output_root, BATCH_SUMMARY_NAME), batch)
+
+    batch = batch_summary(results, time.perf_counter() - start)
+    write_summary(os.path.join(output_root, BATCH_SUMMARY_NAME), batch)
+
+    failed = sum(1 for result in results if "error" in result or result["failed"])
+    print(f"Exported {batch['exported']} of {batch['textures']} textures ({batch['skipped']} unchanged) "
+          f"from {len(results)} archives "
+          f"in {batch['seconds']:.2f}s ({batch['mb_per_second']:.1f} MB/s, "
+          f"{batch['textures_per_second']:.1f} textures/s), {failed} archives with failures")
+    return batch
+
+
+def batch_summary(results, seconds):
+    total_bytes = sum(result["size"] for result in results)
+    exported = sum(result["exported"] for result in results)
+    return {
+        "archives": results,
+        "seconds": seconds,
+        "bytes": total_bytes,
+        "textures": sum(result["textures"] for result in results),
+        "exported": exported,
+        "skipped": sum(result.get("skipped", 0) for result in results),
+        "mb_per_second": total_bytes / (1024 * 1024) / seconds if seconds else 0.0,
+        "textures_per_second": exported / seconds if seconds else 0.0,
+    }
+
+
+def link_or_copy(source, destination):
+    """
+    Hardlinks destination to source, copying instead where links aren't supported.
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        temp_path = temp_path_for(destination)
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+
+
+def dedup_export(archives, output_root, kind="pc", workers=0, use_index=True, link=False, resume=True):
+    """
+    Exports each unique texture of the archives once, keyed by its content, and
+    writes a manifest mapping every (archive, offset) to its unique image. With
+    link the usual per-archive files are created as hardlinks to the unique ones.
+    Returns the manifest.
+    """
+    start = time.perf_counter()
+    unique_dir = os.path.join(output_root, UNIQUE_DIR_NAME)
+    os.makedirs(unique_dir, exist_ok=True)
+    dirs = output_dirs(archives, output_root)
+
+    # Hash every texture; the first texture with a key is the one that gets exported
+    unique = {}
+    entries = []
+    failed_archives = []
+    for archive in archives:
+        try:
+            for texture in iter_archive_textures(archive, kind, use_index):
+                with profiling.stage("hash", bytes_hashed=texture.data_size):
+                    key = texture.content_key()
+                if key not in unique:
+                    representative = copy.copy(texture)
+                    representative.filename = key
+                    unique[key] = representative
+                entries.append((archive, texture, key))
+        except Exception as e:
+            print(f"Failed to scan {archive}: {e}")
+            failed_archives.append({"archive": archive, "error": str(e)})
+    hashed = time.perf_counter()
+
+    def unique_outputs(key):
+        return texture_outputs(unique[key], unique_dir, kind)
+
+    # Encode the unique textures that don't have complete output yet
+    pending = [texture for key, texture in unique.items()
+               if not (resume and all(os.path.exists(path) for path in unique_outputs(key)))]
+    if kind == "ps2":
+        failures = ps2_mode.unswizzle_and_save(pending, unique_dir, workers)
+    else:
+        failures = texture_extraction.convert_textures_to_png(pending, unique_dir, workers)
+    failed_keys = {name for name, error in failures}
+    encoded = time.perf_counter()
+
+    textures = []
+    for archive, texture, key in entries:
+        record = {"archive": archive, "offset": texture.offset, "name": texture.filename, "key": key}
+        if key in failed_keys:
+            record["error"] = "export failed"
+        textures.append(record)
+        if link and key not in failed_keys:
+            os.makedirs(dirs[archive], exist_ok=True)
+            for source, destination in zip(unique_outputs(key), texture_outputs(texture, dirs[archive], kind)):
+                link_or_copy(source, destination)
+
+    unique_bytes = 0
+    images = {}
+    for key, texture in unique.items():
+        outputs = unique_outputs(key)
+        images[key] = {
+            "image": os.path.relpath(outputs[-1], output_root),
+            "width": texture.width,
+            "height": texture.height,
+            "bpp": texture.bpp,
+        }
+        if key not in failed_keys:
+            unique_bytes += sum(os.path.getsize(path) for path in outputs)
+    # What the exports would take without deduplication
+    total_bytes = sum(sum(os.path.getsize(path) for path in unique_outputs(key))
+                      for archive, texture, key in entries if key not in failed_keys)
+
+    seconds = time.perf_counter() - start
+    manifest = {
+        "version": DEDUP_MANIFEST_VERSION,
+        "kind": kind,
+        "unique": images,
+        "textures": textures,
+        "failed_archives": failed_archives,
+        "stats": {
+            "textures": len(entries),
+            "unique": len(unique),
+            "encoded": len(pending) - len(failures),
+            "failed": len(failures),
+            "unique_bytes": unique_bytes,
+            "total_bytes": total_bytes,
+            "hash_seconds": hashed - start,
+            "encode_seconds": encoded - hashed,
+            "seconds": seconds,
+        },
+    }
+    write_summary(os.path.join(output_root, DEDUP_MANIFEST_NAME), manifest)
+
+    print(f"{len(entries)} textures from {len(archives)} archives, {len(unique)} unique "
+          f"({len(pending)} encoded, {len(failures)} failed) in {seconds:.2f}s; "
+          f"{unique_bytes / (1024 * 1024):.1f} MB on disk instead of {total_bytes / (1024 * 1024):.1f} MB")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the textures of many SH3 archives to PNG.")
+    parser.add_argument("paths", nargs="+", help="Archives, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="exported_textures", help="Output root directory")
+    parser.add_argument("--pattern", default="*.arc", help="File pattern to search directories for")
+    parser.add_argument("--ps2", action="store_true", help="Export PS2 textures instead of PC textures")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="Worker processes (0 = one per core)")
+    parser.add_argument("--no-index", action="store_true", help="Ignore the cached texture index and rescan")
+    parser.add_argument("--no-resume", action="store_true", help="Export everything again instead of resuming")
+    parser.add_argument("--dedup", action="store_true", help="Export each unique texture once and write a manifest")
+    parser.add_argument("--link", action="store_true", help="With --dedup, hardlink the per-archive files to the unique ones")
+    parser.add_argument("--profile", nargs="?", const="", metavar="REPORT",
+                        help=f"Profile the stages of the export and write the report (default: <output>/{PROFILE_NAME})")
+    parser.add_argument("--no-trace-memory", action="store_true", help="With --profile, skip the tracemalloc peaks (tracing slows the pure-Python stages a lot)")
+    args = parser.parse_args()
+
+    archives = find_archives(args.paths, args.pattern)
+    if not archives:
+        parser.error("no archives found")
+    kind = "ps2" if args.ps2 else "pc"
+    profile_path = None
+    if args.profile is not None:
+        profile_path = args.profile or os.path.join(args.output, PROFILE_NAME)
+
+    with profiling.profiled(profile_path, enabled=profile_path is not None,
+                            trace_memory=not args.no_trace_memory) as profiler:
+        if args.dedup:
+            manifest = dedup_export(archives, args.output, kind, args.workers, use_index=not args.no_index,
+                                    link=args.link, resume=not args.no_resume)
+            failed = manifest["failed_archives"] or manifest["stats"]["failed"]
+        else:
+            batch = batch_export(archives, args.output, kind, args.workers,
+                                 use_index=not args.no_index, resume=not args.no_resume)
+            failed = any("error" in result or result["failed"] for result in batch["archives"])
+    if profiler is not None:
+        print(profiler.summary())
+        print(f"Profile written to {profile_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
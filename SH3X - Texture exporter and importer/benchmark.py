@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+
+import ps2_mode
+import reimport
+import synthetic_corpus
+import texture_extraction
+from archive_reader import ArchiveReader
+from pixel_conversion import bgra_to_image
+from ps2_palette import decode_palette
+from texture_header import parse_texture_header
+
+# Benchmarks for the texture pipeline on a synthetic corpus.
+# Every stage is run a few times and the best time is kept. Throughput is
+# reported in MB/s of the bytes the stage consumes and in textures/s. Results
+# are written as JSON, and --compare prints the speed of each stage relative
+# to an earlier result file, to catch regressions between releases.
+
+BENCHMARK_VERSION = 1
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline prints progress per texture, which would dominate the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def time_stage(func, repeat):
+    """
+    Returns the best wall time of func() over repeat runs.
+    """
+    best = None
+    for _ in range(repeat):
+        with quiet():
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def stage_result(seconds, size, textures):
+    return {
+        "seconds": seconds,
+        "bytes": size,
+        "textures": textures,
+        "mb_per_second": size / (1024 * 1024) / seconds if seconds else 0.0,
+        "textures_per_second": textures / seconds if seconds else 0.0,
+    }
+
+
+def run_benchmarks(corpus, work_dir, repeat=3, workers=None, stages=None):
+    """
+    Times each stage of the pipeline on the corpus written by
+    synthetic_corpus.write_corpus and returns {stage: result}.
+    """
+    results = {}
+
+    def bench(name, func, size, textures):
+        if stages is not None and name not in stages:
+            return
+        results[name] = stage_result(time_stage(func, repeat), size, textures)
+        print(f"{name:>16}: {results[name]['seconds'] * 1000:9.2f} ms  "
+              f"{results[name]['mb_per_second']:9.1f} MB/s  {results[name]['textures_per_second']:10.1f} textures/s")
+
+    pc_readers = [ArchiveReader(path) for path in corpus["pc"]]
+    ps2_readers = [ArchiveReader(path) for path in corpus["ps2"]]
+    pc_bytes = sum(reader.size for reader in pc_readers)
+    ps2_bytes = sum(reader.size for reader in ps2_readers)
+    with quiet():
+        pc_entries = [texture_extraction.scan_textures(reader) for reader in pc_readers]
+        ps2_entries = [ps2_mode.scan_textures(reader) for reader in ps2_readers]
+    pc_count = sum(len(entries) for entries in pc_entries)
+    ps2_count = sum(len(entries) for entries in ps2_entries)
+
+    # Scanning whole files for texture headers
+    bench("scan_pc", lambda: [texture_extraction.scan_textures(reader) for reader in pc_readers], pc_bytes, pc_count)
+    bench("scan_ps2", lambda: [ps2_mode.scan_textures(reader) for reader in ps2_readers], ps2_bytes, ps2_count)
+
+    # Decoding known texture headers
+    header_offsets = [(reader, entry["header_offset"])
+                      for reader, entries in zip(pc_readers + ps2_readers, pc_entries + ps2_entries)
+                      for entry in entries]
+    bench("parse_headers", lambda: [parse_texture_header(reader.buffer, offset) for reader, offset in header_offsets],
+          len(header_offsets) * 24, len(header_offsets))
+
+    # Swizzling and unswizzling the PS2 texel data
+    ps2_textures = [(reader, entry) for reader, entries in zip(ps2_readers, ps2_entries) for entry in entries]
+    for bpp in (8, 4):
+        textures = [(reader.read(entry["offset"], entry["data_size"]), entry)
+                    for reader, entry in ps2_textures if entry["bpp"] == bpp]
+        if not textures:
+            continue
+        size = sum(len(data) for data, entry in textures)
+        bench(f"unswizzle_{bpp}bpp",
+              lambda textures=textures: [ps2_mode.unswizzle_texture(data, entry["width"], entry["height"], bpp)
+                                         for data, entry in textures],
+              size, len(textures))
+        if bpp == 8:
+            linear = [(ps2_mode.unswizzle_8_to_32(data, entry["width"], entry["height"]), entry)
+                      for data, entry in textures]
+            bench("swizzle_8bpp",
+                  lambda: [ps2_mode.swizzle_8_to_32(data, entry["width"], entry["height"]) for data, entry in linear],
+                  size, len(linear))
+
+    # Decoding palettes
+    palettes = [(reader.read(entry["palette_data_offset"], entry["palette_data_size"]), entry)
+                for reader, entry in ps2_textures]
+    bench("palette_decode",
+          lambda: [decode_palette(data, entry["palette_data_size"], entry["entry_size"], entry["bypp"])
+                   for data, entry in palettes],
+          sum(len(data) for data, entry in palettes), len(palettes))
+
+    # BGRA to image conversion of the PC textures
+    pc_textures = [(reader.view(entry["offset"], entry["data_size"]), entry)
+                   for reader, entries in zip(pc_readers, pc_entries) for entry in entries]
+    pc_data_bytes = sum(entry["data_size"] for data, entry in pc_textures)
+    bench("bgra_to_image", lambda: [bgra_to_image(data, entry["width"], entry["height"]) for data, entry in pc_textures],
+          pc_data_bytes, len(pc_textures))
+
+    # PNG export of both platforms
+    png_dirs = []
+    for i, path in enumerate(corpus["pc"]):
+        png_dir = os.path.join(work_dir, f"png_pc_{i}")
+        os.makedirs(png_dir, exist_ok=True)
+        png_dirs.append((path, png_dir))
+
+    def export_pc():
+        for path, png_dir in png_dirs:
+            textures = list(texture_extraction.iter_textures(path, use_index=False))
+            texture_extraction.convert_textures_to_png(textures, png_dir, workers)
+
+    bench("export_png_pc", export_pc, pc_data_bytes, pc_count)
+
+    ps2_png_dir = os.path.join(work_dir, "png_ps2")
+    os.makedirs(ps2_png_dir, exist_ok=True)
+
+    def export_ps2():
+        textures = list(ps2_mode.iter_textures(corpus["ps2"], use_index=False))
+        ps2_mode.unswizzle_and_save(textures, ps2_png_dir, workers)
+
+    bench("export_png_ps2", export_ps2, sum(entry["data_size"] for reader, entry in ps2_textures), ps2_count)
+
+    # Reimport of the exported PNGs into copies of the archives
+    if stages is None or "reimport" in stages:
+        if stages is not None and "export_png_pc" not in stages:
+            with quiet():
+                export_pc()
+        targets = []
+        for path, png_dir in png_dirs:
+            target = os.path.join(work_dir, "reimport_" + os.path.basename(path))
+            shutil.copyfile(path, target)
+            targets.append((target, png_dir))
+        bench("reimport", lambda: [reimport.import_textures(target, png_dir, workers=workers)
+                                   for target, png_dir in targets],
+              pc_data_bytes, pc_count)
+
+    for reader in pc_readers + ps2_readers:
+        reader.close()
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+    }
+
+
+def compare(results, baseline):
+    """
+    Prints each stage's throughput relative to a baseline result file.
+    """
+    print(f"\nCompared with {baseline.get('label') or 'baseline'}:")
+    for name, result in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or not previous["seconds"]:
+            print(f"{name:>16}: new")
+            continue
+        ratio = previous["seconds"] / result["seconds"] if result["seconds"] else float("inf")
+        print(f"{name:>16}: {ratio:6.2f}x {'faster' if ratio >= 1 else 'slower'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the texture pipeline on synthetic archives.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--label", help="Name stored with the results, e.g. a version")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best time is kept")
+    parser.add_argument("-j", "--workers", type=int, help="Worker processes for export and reimport (0 = one per core)")
+    parser.add_argument("--stages", help="Comma separated stages to run (default: all)")
+    parser.add_argument("--pc-archives", type=int, default=2)
+    parser.add_argument("--groups", type=int, default=4, help="Master header groups per PC archive")
+    parser.add_argument("--textures-per-group", type=int, default=8)
+    parser.add_argument("--pc-sizes", type=synthetic_corpus.parse_sizes, default="128x128,256x256")
+    parser.add_argument("--ps2-files", type=int, default=2)
+    parser.add_argument("--ps2-textures", type=int, default=16, help="Textures per PS2 file")
+    parser.add_argument("--ps2-sizes", type=synthetic_corpus.parse_sizes, default="256x128,256x256")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus_params = {
+        "pc_archives": args.pc_archives,
+        "groups": args.groups,
+        "textures_per_group": args.textures_per_group,
+        "pc_sizes": args.pc_sizes,
+        "ps2_files": args.ps2_files,
+        "ps2_textures": args.ps2_textures,
+        "ps2_sizes": args.ps2_sizes,
+        "seed": args.seed,
+    }
+    stages = set(args.stages.split(",")) if args.stages else None
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus = synthetic_corpus.write_corpus(os.path.join(work_dir, "corpus"), **corpus_params)
+        results = {
+            "version": BENCHMARK_VERSION,
+            "label": args.label,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": environment(),
+            "corpus": corpus_params,
+            "repeat": args.repeat,
+            "workers": args.workers,
+            "results": run_benchmarks(corpus, work_dir, args.repeat, args.workers, stages),
+        }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import json
+import os
+
+from atomic_io import temp_path_for
+
+# Checkpoints for resumable batch jobs.
+# A checkpoint is a JSON lines journal: a header line naming the job, then one
+# line per completed item with the inputs it was made from and the size and
+# mtime of the files it wrote. Lines are appended and flushed as items
+# complete, so an interrupted run loses at most the item in progress (a torn
+# last line is dropped when the journal is read back). An item is only
+# skipped on a rerun while its inputs are the same and its output files are
+# still exactly the ones that were recorded.
+
+CHECKPOINT_VERSION = 1
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Checkpoint:
+    def __init__(self, path, job):
+        self.path = path
+        self.job = job
+        self.items = {}
+        # Inputs of the whole job when it last ran to completion
+        self.completed = None
+        self._file = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        if header.get("version") != CHECKPOINT_VERSION or header.get("job") != self.job:
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "complete" in record:
+                self.completed = record["complete"]
+            else:
+                self.items[record["name"]] = record
+
+    def _output_name(self, path):
+        return os.path.relpath(path, os.path.dirname(os.path.abspath(self.path)))
+
+    def _outputs_current(self, record):
+        base = os.path.dirname(os.path.abspath(self.path))
+        return all(file_stamp(os.path.join(base, name)) == stamp for name, stamp in record["outputs"].items())
+
+    def is_current(self, name, inputs):
+        """
+        True if item name was completed from the same inputs and its outputs are unchanged.
+        """
+        record = self.items.get(name)
+        return record is not None and record["inputs"] == inputs and self._outputs_current(record)
+
+    def is_complete(self, inputs):
+        """
+        True if the whole job ran to completion from the same inputs and no output changed since.
+        """
+        return (self.completed is not None and self.completed == inputs
+                and all(self._outputs_current(record) for record in self.items.values()))
+
+    def _rewrite(self, completed=None):
+        # Rewrites the journal from the records in memory, dropping any torn line
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = temp_path_for(self.path)
+        with open(temp_path, "w") as f:
+            f.write(json.dumps({"version": CHECKPOINT_VERSION, "job": self.job}) + "\n")
+            for record in self.items.values():
+                f.write(json.dumps(record) + "\n")
+            if completed is not None:
+                f.write(json.dumps({"complete": completed}) + "\n")
+        os.replace(temp_path, self.path)
+
+    def mark(self, name, inputs, outputs=()):
+        """
+        Records item name as completed from inputs, having written the files in outputs.
+        """
+        if self._file is None:
+            self._rewrite()
+            self._file = open(self.path, "a")
+        record = {
+            "name": name,
+            "inputs": inputs,
+            "outputs": {self._output_name(path): file_stamp(path) for path in outputs},
+        }
+        self.items[name] = record
+        self.completed = None
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def finish(self, inputs):
+        """
+        Marks the whole job as completed from inputs.
+        """
+        self.close()
+        self._rewrite(inputs)
+        self.completed = inputs
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
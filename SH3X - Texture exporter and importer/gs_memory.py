@@ -0,0 +1,376 @@
+import functools
+import threading
+import time
+import numpy as np
+
+# Emulation of the PS2 Graphics Synthesizer's local memory.
+# The GS stores pixels in 4 MiB of local memory in pages of 8 KiB, split into
+# 32 blocks of 4 columns, and every pixel storage mode (PSM) arranges its
+# pixels differently inside them. Games upload texture data in one mode and
+# sample it in another, so converting between the two is how swizzled PS2
+# textures are decoded. This is a NumPy port of Victor Suba's
+# GSTextureConvert tables (see ps2textures): the local memory is allocated
+# once per thread (local_memory) and reused, the address of every pixel of a
+# transfer rectangle is computed once per (psm, dbp, dbw, rectangle) and
+# cached, and uploads and downloads are then a single scatter or gather.
+
+GS_MEMORY_SIZE = 4 * 1024 * 1024
+
+# Words (32 bits) per page, block and column
+PAGE_WORDS = 2048
+BLOCK_WORDS = 64
+COLUMN_WORDS = 16
+
+# Number of address maps kept
+ADDRESS_CACHE_SIZE = 64
+
+PSMCT32 = 0x00
+PSMCT16 = 0x02
+PSMT8 = 0x13
+PSMT4 = 0x14
+
+BITS_PER_PIXEL = {PSMCT32: 32, PSMCT16: 16, PSMT8: 8, PSMT4: 4}
+
+block32 = [
+    0, 1, 4, 5, 16, 17, 20, 21,
+    2, 3, 6, 7, 18, 19, 22, 23,
+    8, 9, 12, 13, 24, 25, 28, 29,
+    10, 11, 14, 15, 26, 27, 30, 31
+]
+
+columnWord32 = [
+    0, 1, 4, 5, 8, 9, 12, 13,
+    2, 3, 6, 7, 10, 11, 14, 15
+]
+
+block16 = [
+    0, 2, 8, 10, 1, 3, 9, 11,
+    4, 6, 12, 14, 5, 7, 13, 15,
+    16, 18, 24, 26, 17, 19, 25, 27,
+    20, 22, 28, 30, 21, 23, 29, 31
+]
+
+columnWord16 = [
+    0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13,
+    2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15
+]
+
+columnHalf16 = [
+    0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1,
+    0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1
+]
+
+block8 = [
+    0, 1, 4, 5, 16, 17, 20, 21,
+    2, 3, 6, 7, 18, 19, 22, 23,
+    8, 9, 12, 13, 24, 25, 28, 29,
+    10, 11, 14, 15, 26, 27, 30, 31
+]
+
+columnWord8 = [
+    [
+        0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13,
+        2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15,
+
+        8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5,
+        10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7
+    ],
+    [
+        8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5,
+        10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7,
+
+        0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13,
+        2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15
+    ]
+]
+
+columnByte8 = [
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2,
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2,
+
+    1, 1, 1, 1, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3,
+    1, 1, 1, 1, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3
+]
+
+block4 = [
+    0, 2, 8, 10,
+    1, 3, 9, 11,
+    4, 6, 12, 14,
+    5, 7, 13, 15,
+    16, 18, 24, 26,
+    17, 19, 25, 27,
+    20, 22, 28, 30,
+    21, 23, 29, 31
+]
+
+columnWord4 = [
+    [
+        0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13,
+        2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15,
+
+        8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5,
+        10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7
+    ],
+    [
+        8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5,
+        10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7,
+
+        0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13, 0, 1, 4, 5, 8, 9, 12, 13,
+        2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15, 2, 3, 6, 7, 10, 11, 14, 15
+    ]
+]
+
+columnByte4 = [
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 4, 4, 4, 4, 4, 6, 6, 6, 6, 6, 6, 6, 6,
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 4, 4, 4, 4, 4, 6, 6, 6, 6, 6, 6, 6, 6,
+
+    1, 1, 1, 1, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 5, 5, 5, 5, 5, 5, 5, 5, 7, 7, 7, 7, 7, 7, 7, 7,
+    1, 1, 1, 1, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3, 3, 5, 5, 5, 5, 5, 5, 5, 5, 7, 7, 7, 7, 7, 7, 7, 7
+]
+
+# Per PSM: page width and height, block width and height, blocks per page row,
+# block table, column height in pixels
+_LAYOUTS = {
+    PSMCT32: (64, 32, 8, 8, 8, block32, 2),
+    PSMCT16: (64, 64, 16, 8, 4, block16, 2),
+    PSMT8: (128, 64, 16, 16, 8, block8, 4),
+    PSMT4: (128, 128, 32, 16, 4, block4, 4),
+}
+
+
+def _table(values):
+    return np.array(values, dtype=np.intp)
+
+
+_BLOCK_TABLES = {psm: _table(layout[5]) for psm, layout in _LAYOUTS.items()}
+_COLUMN_WORD32 = _table(columnWord32)
+_COLUMN_WORD16 = _table(columnWord16)
+_COLUMN_HALF16 = _table(columnHalf16)
+_COLUMN_WORD8 = _table(columnWord8)
+_COLUMN_BYTE8 = _table(columnByte8)
+_COLUMN_WORD4 = _table(columnWord4)
+_COLUMN_BYTE4 = _table(columnByte4)
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def address_map(psm, dbp, dbw, x, y, width, height, memory_size=GS_MEMORY_SIZE):
+    """
+    Returns the location of every pixel of the width x height rectangle at
+    (x, y) of a buffer at block dbp, dbw * 64 pixels wide, in row order, as a
+    read-only NumPy array. Locations are in units of the pixel size: words for
+    PSMCT32, halfwords for PSMCT16, bytes for PSMT8 and nibbles (low nibble
+    first) for PSMT4. Addresses wrap around the end of memory like on the GS.
+    """
+    if psm not in _LAYOUTS:
+        raise ValueError(f"Unsupported pixel storage mode: {psm:#x}")
+    page_width, page_height, block_width, block_height, blocks_per_row, _, column_height = _LAYOUTS[psm]
+    if psm in (PSMT8, PSMT4):
+        # Their pages are 128 pixels wide
+        dbw >>= 1
+
+    py, px = np.indices((height, width), dtype=np.intp)
+    px += x
+    py += y
+    page = (px // page_width) + (py // page_height) * dbw
+    px %= page_width
+    py %= page_height
+    block = _BLOCK_TABLES[psm][(px // block_width) + (py // block_height) * blocks_per_row]
+    bx = px % block_width
+    by = py % block_height
+    column = by // column_height
+    cy = by % column_height
+    word = dbp * BLOCK_WORDS + page * PAGE_WORDS + block * BLOCK_WORDS + column * COLUMN_WORDS
+
+    if psm == PSMCT32:
+        location = word + _COLUMN_WORD32[bx + cy * 8]
+        units = memory_size // 4
+    elif psm == PSMCT16:
+        location = (word + _COLUMN_WORD16[bx + cy * 16]) * 2 + _COLUMN_HALF16[bx + cy * 16]
+        units = memory_size // 2
+    elif psm == PSMT8:
+        cell = bx + cy * 16
+        location = (word + _COLUMN_WORD8[column & 1, cell]) * 4 + _COLUMN_BYTE8[cell]
+        units = memory_size
+    else:
+        cell = bx + cy * 32
+        cb = _COLUMN_BYTE4[cell]
+        location = ((word + _COLUMN_WORD4[column & 1, cell]) * 4 + (cb >> 1)) * 2 + (cb & 1)
+        units = memory_size * 2
+
+    location = (location % units).ravel()
+    location.flags.writeable = False
+    return location
+
+
+class GSMemory:
+    """
+    GS local memory. Pass buffer to work on existing memory contents (e.g. a
+    4 MiB bytearray) without copying them.
+    """
+
+    def __init__(self, buffer=None, size=GS_MEMORY_SIZE):
+        if buffer is None:
+            self.memory = np.zeros(size, dtype=np.uint8)
+        else:
+            self.memory = np.frombuffer(buffer, dtype=np.uint8)
+            if not self.memory.flags.writeable:
+                self.memory = self.memory.copy()
+        self.size = self.memory.size
+
+    def clear(self):
+        self.memory[:] = 0
+
+    def _map(self, psm, dbp, dbw, x, y, width, height):
+        return address_map(psm, dbp, dbw, x, y, width, height, self.size)
+
+    def upload(self, psm, dbp, dbw, x, y, width, height, data):
+        """
+        Writes width x height pixels of data (little endian, 4bpp low nibble
+        first) to the rectangle at (x, y) of the buffer at dbp, like a
+        host to local transfer.
+        """
+        locations = self._map(psm, dbp, dbw, x, y, width, height)
+        count = width * height
+        if psm == PSMCT32:
+            self.memory.view("<u4")[locations] = np.frombuffer(data, dtype="<u4", count=count)
+        elif psm == PSMCT16:
+            self.memory.view("<u2")[locations] = np.frombuffer(data, dtype="<u2", count=count)
+        elif psm == PSMT8:
+            self.memory[locations] = np.frombuffer(data, dtype=np.uint8, count=count)
+        else:
+            packed = np.frombuffer(data, dtype=np.uint8, count=(count + 1) // 2)
+            texels = np.empty(packed.size * 2, dtype=np.uint8)
+            texels[0::2] = packed & 0xf
+            texels[1::2] = packed >> 4
+            texels = texels[:count]
+            # Low and high nibbles are written separately so no byte is written twice in one pass
+            for nibble in (0, 1):
+                selected = (locations & 1) == nibble
+                byte_locations = locations[selected] >> 1
+                if nibble:
+                    values = (self.memory[byte_locations] & 0x0f) | (texels[selected] << 4)
+                else:
+                    values = (self.memory[byte_locations] & 0xf0) | texels[selected]
+                self.memory[byte_locations] = values
+
+    def download(self, psm, dbp, dbw, x, y, width, height):
+        """
+        Reads the width x height rectangle at (x, y) of the buffer at dbp,
+        like a local to host transfer, and returns its pixels as bytes.
+        """
+        return self._gather(psm, dbp, dbw, x, y, width, height).tobytes()
+
+    def _gather(self, psm, dbp, dbw, x, y, width, height):
+        # The pixels of a download as a new NumPy array
+        locations = self._map(psm, dbp, dbw, x, y, width, height)
+        if psm == PSMCT32:
+            return self.memory.view("<u4")[locations]
+        if psm == PSMCT16:
+            return self.memory.view("<u2")[locations]
+        if psm == PSMT8:
+            return self.memory[locations]
+        texels = (self.memory[locations >> 1] >> ((locations & 1) * 4).astype(np.uint8)) & 0xf
+        if texels.size % 2:
+            texels = np.append(texels, np.uint8(0))
+        return (texels[0::2] | (texels[1::2] << 4)).astype(np.uint8)
+
+
+_local = threading.local()
+
+
+def local_memory():
+    """
+    Returns this thread's reusable GS memory, allocated on first use. Its
+    contents are whatever the last transfer on the thread left; clear() it
+    first where that matters.
+    """
+    memory = getattr(_local, "memory", None)
+    if memory is None:
+        memory = _local.memory = GSMemory()
+    return memory
+
+
+def convert(data, width, height, src_psm, dst_psm, dbp=0, memory=None):
+    """
+    Uploads width x height pixels of data in src_psm and downloads the same
+    memory as dst_psm, with the size and buffer width scaled to cover the
+    same bytes. E.g. convert(data, w // 2, h // 4, PSMCT32, PSMT4) reads 4bpp
+    texels that were uploaded as a 32-bit texture. memory defaults to the
+    thread's local_memory(). Returns a memoryview of the downloaded pixels.
+    """
+    if memory is None:
+        memory = local_memory()
+    # Pixels of partial pages were never uploaded, they read back as 0
+    memory.clear()
+    memory.upload(src_psm, dbp, max(1, width // 64), 0, 0, width, height, data)
+    dst_width, dst_height = _converted_size(width, height, src_psm, dst_psm)
+    return memoryview(memory._gather(dst_psm, dbp, max(1, dst_width // 64), 0, 0, dst_width, dst_height)).cast("B")
+
+
+def _converted_size(width, height, src_psm, dst_psm):
+    # The same number of pages in both modes
+    src_page_width, src_page_height = _LAYOUTS[src_psm][:2]
+    dst_page_width, dst_page_height = _LAYOUTS[dst_psm][:2]
+    return width * dst_page_width // src_page_width, height * dst_page_height // src_page_height
+
+
+def self_check(repeat=3):
+    """
+    Checks uploads and downloads against the texture unswizzlers in ps2_swizzle
+    (8bpp uploaded as PSMCT32 and read as PSMT8, Sparky's 4bpp type 1 as
+    PSMCT32 uploaded transposed and read as PSMT4), that every mode's download returns what was
+    uploaded, and times the transfers. Returns True when all checks pass.
+    """
+    import ps2_swizzle
+
+    rng = np.random.default_rng(0)
+    ok = True
+
+    def check(condition, message):
+        nonlocal ok
+        if not condition:
+            ok = False
+            print(f"FAIL {message}")
+
+    for width, height in ((128, 64), (256, 256), (512, 128)):
+        data = rng.integers(0, 256, width * height, dtype=np.uint8).tobytes()
+        memory = GSMemory()
+        memory.upload(PSMCT32, 0, width // 2 // 64, 0, 0, width // 2, height // 2, data)
+        check(memory.download(PSMT8, 0, width // 64, 0, 0, width, height) == ps2_swizzle.unswizzle8(data, width, height),
+              f"PSMCT32 -> PSMT8 {width}x{height} differs from unswizzle8")
+
+    for width, height in ((128, 128), (256, 128), (128, 256), (512, 256)):
+        data = rng.integers(0, 256, width * height // 2, dtype=np.uint8).tobytes()
+        # Sparky's layout is uploaded transposed: height / 2 words wide and width / 4 high
+        memory = GSMemory()
+        memory.upload(PSMCT32, 0, height // 2 // 64, 0, 0, height // 2, width // 4, data)
+        check(memory.download(PSMT4, 0, width // 64, 0, 0, width, height)
+              == ps2_swizzle.unswizzle4(data, width, height, ps2_swizzle.TYPE1),
+              f"PSMCT32 -> PSMT4 {width}x{height} differs from the type 1 unswizzle")
+
+    memory = GSMemory()
+    for psm, bpp in BITS_PER_PIXEL.items():
+        for dbp, dbw, x, y, width, height in ((0, 4, 0, 0, 256, 128), (96, 2, 16, 8, 64, 40), (1000, 1, 3, 5, 29, 7)):
+            data = rng.integers(0, 256, (width * height * bpp + 7) // 8, dtype=np.uint8)
+            if bpp == 4 and width * height % 2:
+                # The unused high nibble of the last byte reads back as 0
+                data[-1] &= 0x0f
+            data = data.tobytes()
+            memory.upload(psm, dbp, dbw, x, y, width, height, data)
+            check(memory.download(psm, dbp, dbw, x, y, width, height) == data,
+                  f"psm {psm:#x} round trip of {width}x{height} at ({x}, {y}) dbp {dbp} dbw {dbw}")
+            locations = address_map(psm, dbp, dbw, x, y, width, height)
+            check(np.unique(locations).size == locations.size, f"psm {psm:#x} address map is not one to one")
+
+    data = rng.integers(0, 256, 512 * 512 // 2, dtype=np.uint8).tobytes()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert(data, 256, 128, PSMCT32, PSMT4)
+        elapsed = time.perf_counter() - start
+    print(f"PSMCT32 -> PSMT4 of a 512x512 4bpp texture: {elapsed * 1000:.2f} ms")
+    print(f"GS memory self-check: {'passed' if ok else 'FAILED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if self_check() else 1)
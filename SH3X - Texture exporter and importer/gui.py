@@ -6,16 +6,24 @@ from tkinter import filedialog
 from tkinter import messagebox
 from PIL import Image, ImageTk
 import image_processing
+import pixel_conversion
 from image_processing import convert_bgra_to_rgba, convert_rgba_to_bgra, save_images, import_png
 import ps2_mode
 import pyglet.image.codecs.dds
 from typing import List, Tuple
 import texture_extraction  # Added import for texture_extraction
 import batch_analysis
+import reimport
+import texture_patch
 import matplotlib.pyplot as plt
 import numpy as np
 import threading
+import queue
 import ps2textures
+import image_cache
+import profiling
+from background_scan import BackgroundScan
+from thumbnail_grid import ThumbnailGrid
 
 
 global file_path  # Define file_path as a global variable
@@ -27,60 +35,144 @@ def import_file(root):
         import_png(png_file_path, bgra_file_path)
         messagebox.showinfo("Import Complete", "File imported successfully!")
 
-def extract_textures(root):
+def profile_message(profiler, report_path):
+    # Appended to the completion message when the Profile box is ticked
+    if profiler is None:
+        return ""
+    print(profiler.summary())
+    return f"\n\n{profiler.summary()}\n\nProfile written to {report_path}"
+
+def extract_textures(root, profile=None):
     filename = filedialog.askopenfilename(parent=root, title='Select a .arc file')
     if filename:
         # import the module and extract the textures from the file
         import texture_extraction
 
-        # extract textures from the .arc file
-        textures = texture_extraction.extract_textures(filename)
-
         # create a new directory to store the extracted textures as .png images
         output_dir = os.path.splitext(filename)[0] + "_textures"
         os.makedirs(output_dir, exist_ok=True)
+        report_path = os.path.join(output_dir, "profile.json")
+
+        with profiling.profiled(report_path, enabled=profile is not None and profile.get()) as profiler:
+            # extract textures from the .arc file
+            textures = texture_extraction.extract_textures(filename)
 
-        # convert and save the textures as .png images
-        texture_extraction.convert_textures_to_png(textures, output_dir)
+            # convert and save the textures as .png images
+            texture_extraction.convert_textures_to_png(textures, output_dir, workers=0)
 
-        messagebox.showinfo("Extraction Complete", f"{len(textures)} textures extracted and saved as .png images to {output_dir}!")
+        messagebox.showinfo("Extraction Complete", f"{len(textures)} textures extracted and saved as .png images to {output_dir}!"
+                            + profile_message(profiler, report_path))
 
 def reimport_textures(root):
     filename = filedialog.askopenfilename(parent=root, title='Select a .arc file')
     if filename:
         png_dir = filedialog.askdirectory(parent=root, title='Select the directory containing the new PNG-encoded textures')
         if png_dir:
-            # Run the import_textures function in a separate thread
-            thread = threading.Thread(target=import_textures, args=(filename, png_dir))
+            # Progress window, updated from the reimport thread through a queue
+            window = tk.Toplevel(root)
+            window.title("Reimporting Textures")
+            progress_label = tk.Label(window, text="Starting reimport...", width=60, anchor="w")
+            progress_label.pack(padx=10, pady=10)
+            updates = queue.Queue()
+
+            def on_progress(done, total, png_file, status, error):
+                updates.put(("progress", f"{done}/{total}  {status}: {png_file}"))
+
+            def run_reimport():
+                try:
+                    summary = reimport.import_textures(filename, png_dir, incremental=True, workers=0, progress=on_progress)
+                    updates.put(("done", summary))
+                except Exception as e:
+                    updates.put(("error", str(e)))
+
+            def poll_updates():
+                while True:
+                    try:
+                        kind, value = updates.get_nowait()
+                    except queue.Empty:
+                        break
+                    if kind == "progress":
+                        progress_label.config(text=value)
+                    elif kind == "done":
+                        window.destroy()
+                        message = f"{value['written']} textures written, {value['skipped']} unchanged textures skipped."
+                        if value["failed"]:
+                            failed = "\n".join(f"{png_file}: {error}" for png_file, error in value["failed"][:10])
+                            message += f"\n\n{len(value['failed'])} textures failed:\n{failed}"
+                        messagebox.showinfo("Reimport Complete", message)
+                        return
+                    else:
+                        window.destroy()
+                        messagebox.showerror("Reimport Failed", value)
+                        return
+                root.after(100, poll_updates)
+
+            # Run the import_textures function in a separate thread, only writing textures that changed
+            thread = threading.Thread(target=run_reimport)
             thread.daemon = True  # This ensures the thread will close when the application closes
             thread.start()
-            messagebox.showinfo("Reimport Started", "Texture reimport has started. You will be notified when it's finished.")
+            poll_updates()
 
-def analyze_textures(root):
+def apply_patch(root):
+    patch_path = filedialog.askopenfilename(parent=root, title='Select a patch file', filetypes=[("SH3 patch files", "*.sh3patch"), ("All files", "*.*")])
+    if patch_path:
+        filename = filedialog.askopenfilename(parent=root, title='Select the archive to patch')
+        if filename:
+            try:
+                count = texture_patch.apply_patch(patch_path, filename)
+            except texture_patch.PatchError as e:
+                messagebox.showerror("Patch Failed", str(e))
+                return
+            messagebox.showinfo("Patch Applied", f"{count} changes applied to {filename}!")
+
+def analyze_textures(root, profile=None):
     filenames = filedialog.askopenfilenames(parent=root, title='Select files', filetypes=[("All files", "*.*")])
     if filenames:
         # Assuming you want to create the output directory based on the first selected file
         first_filename = filenames[0]
-        textures = ps2_mode.analyze_textures(filenames)
-        # display a message box with the analysis results
-        num_textures = len(textures)
-        messagebox.showinfo("Texture Analysis", f"{num_textures} textures analyzed!")
-        
         # create a new directory to store the extracted textures as unswizzled images
         output_dir = os.path.splitext(first_filename)[0] + "_textures"
         os.makedirs(output_dir, exist_ok=True)
+        report_path = os.path.join(output_dir, "profile.json")
+
+        with profiling.profiled(report_path, enabled=profile is not None and profile.get()) as profiler:
+            textures = ps2_mode.analyze_textures(filenames)
+            # display a message box with the analysis results
+            num_textures = len(textures)
+            messagebox.showinfo("Texture Analysis", f"{num_textures} textures analyzed!")
 
-        # convert and save the textures as .png
-        ps2_mode.unswizzle_and_save(textures, output_dir)
+            # convert and save the textures as .png
+            ps2_mode.unswizzle_and_save(textures, output_dir, workers=0)
 
-        messagebox.showinfo("Extraction Complete", f"{len(textures)} textures extracted and saved as unswizzled and colorized data to {output_dir}!")
+        messagebox.showinfo("Extraction Complete", f"{len(textures)} textures extracted and saved as unswizzled and colorized data to {output_dir}!"
+                            + profile_message(profiler, report_path))
         
         
-def display_texture(textures, index):
+def display_texture(textures, index, scan=None, decode=None):
+    """
+    Shows textures[index] with buttons to step through the list. When scan (a
+    BackgroundScan filling textures) is given, the texture count is kept up to
+    date and the Next/Previous range grows as the scan finds more textures.
+    decode turns a texture into an image and defaults to the PC decoder.
+    """
+    pc_textures = decode is None
+    if decode is None:
+        decode = texture_extraction.convert_texture_to_image
+    # Decoded images are cached and the neighbouring textures prefetched in the background
+    prefetcher = image_cache.Prefetcher(textures, decode)
     texture = textures[index]
-    img = texture_extraction.convert_texture_to_image(texture)
+    img = prefetcher.get(index)
     window = tk.Toplevel()
 
+    def on_destroy(event):
+        if event.widget is window:
+            prefetcher.stop()
+            # Release the archive, so it can be patched while the GUI stays open
+            if scan is not None:
+                scan.close()
+
+    window.bind("<Destroy>", on_destroy)
+
     # Create a frame for image display
     image_frame = tk.Frame(window)
     image_frame.pack(fill=tk.BOTH, expand=True)
@@ -94,42 +186,71 @@ def display_texture(textures, index):
     texture_info = tk.Label(window, text=f"Name: {texture['filename']}, Size: {texture['width']}x{texture['height']}")
     texture_info.pack()
 
+    # Display the texture position and the live texture count
+    texture_count = tk.Label(window)
+    texture_count.pack()
+
+    def update_texture_count():
+        status = scan.status() if scan is not None else f"{len(textures)} textures"
+        texture_count.config(text=f"Texture {index + 1} of {status}")
+
+    def poll_scan():
+        if not window.winfo_exists():
+            return
+        update_texture_count()
+        if not scan.done:
+            window.after(200, poll_scan)
+
+    if scan is not None:
+        poll_scan()
+    else:
+        update_texture_count()
+
     # Create a frame for buttons
     button_frame = tk.Frame(window)
     button_frame.pack(side=tk.BOTTOM, fill=tk.X)
 
-    def show_next_texture():
+    def show_texture(new_index):
         nonlocal index
-        index = (index + 1) % len(textures)  # Cycle through textures
+        index = new_index % len(textures)  # Cycle through textures
         next_texture = textures[index]
-        next_img = texture_extraction.convert_texture_to_image(next_texture)
+        next_img = prefetcher.get(index)
         next_img_tk = ImageTk.PhotoImage(next_img)
         label.config(image=next_img_tk)
         label.img = next_img_tk  # Update the reference to prevent garbage collection
         # Update texture info
         texture_info.config(text=f"Name: {next_texture['filename']}, Size: {next_texture['width']}x{next_texture['height']}")
+        update_texture_count()
+
+    def show_next_texture():
+        show_texture(index + 1)
+
+    def show_previous_texture():
+        show_texture(index - 1)
 
     def export_texture(format):
         filename = filedialog.asksaveasfilename(defaultextension=f".{format.lower()}", filetypes=[(f"{format} files", f"*.{format.lower()}")])
         if filename:
-            texture = textures[index]
-            img = texture_extraction.convert_texture_to_image(texture)
+            img = prefetcher.get(index)
             img.save(filename, format=format)
             messagebox.showinfo("Export Complete", f"Texture exported successfully as {format}!")
 
     def import_texture():
         filename = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.bmp")])
         if filename:
-            new_img = Image.open(filename)
-            new_rgba_data = new_img.tobytes()
-            new_bgra_data = image_processing.convert_rgba_to_bgra(new_rgba_data)
+            new_img = Image.open(filename).convert("RGBA")
+            new_bgra_data = pixel_conversion.image_to_bgra(new_img)
             textures[index]['data'] = new_bgra_data
+            prefetcher.replace(index, new_img)
             # Optionally, refresh the displayed image
             img_tk = ImageTk.PhotoImage(new_img)
             label.config(image=img_tk)
             label.img = img_tk
             messagebox.showinfo("Import Complete", "Texture imported successfully!")
 
+    previous_button = tk.Button(button_frame, text="Previous", command=show_previous_texture)
+    previous_button.pack(side=tk.LEFT)
+
     next_button = tk.Button(button_frame, text="Next", command=show_next_texture)
     next_button.pack(side=tk.LEFT)
 
@@ -139,8 +260,10 @@ def display_texture(textures, index):
     export_bmp_button = tk.Button(button_frame, text="Export as BMP", command=lambda: export_texture('BMP'))
     export_bmp_button.pack(side=tk.LEFT)
 
-    import_button = tk.Button(button_frame, text="Import", command=import_texture)
-    import_button.pack(side=tk.LEFT)
+    # Importing writes BGRA data, which only applies to PC textures
+    if pc_textures:
+        import_button = tk.Button(button_frame, text="Import", command=import_texture)
+        import_button.pack(side=tk.LEFT)
 
     window.mainloop()
 
@@ -148,35 +271,81 @@ def display_texture(textures, index):
 def view_texture(root):
     filename = filedialog.askopenfilename(parent=root, title='Select a .arc file')
     if filename:
-        textures = texture_extraction.extract_textures(filename)
-        display_texture(textures, 0)  # Initially display the first texture
+        # Scan in the background and open the viewer as soon as the first texture is found.
+        # Only the texture descriptors are kept, payloads are read from the archive when displayed.
+        scan = BackgroundScan(texture_extraction.iter_textures(filename))
+
+        def wait_for_first_texture():
+            if scan.textures:
+                display_texture(scan.textures, 0, scan)  # Initially display the first texture
+            elif scan.done:
+                if scan.error is not None:
+                    messagebox.showerror("Texture Viewer", f"Could not read {filename}: {scan.error}")
+                else:
+                    messagebox.showinfo("Texture Viewer", f"No textures found in {filename}.")
+            else:
+                root.after(50, wait_for_first_texture)
+
+        wait_for_first_texture()
+
+
+def browse_textures(root):
+    filename = filedialog.askopenfilename(parent=root, title='Select an archive')
+    if filename:
+        ps2 = messagebox.askyesno("Thumbnail Browser", "Is this a PS2 archive?", parent=root)
+        if ps2:
+            scan = BackgroundScan(ps2_mode.iter_textures([filename]))
+            decode = ps2_mode.convert_texture_to_image
+        else:
+            scan = BackgroundScan(texture_extraction.iter_textures(filename))
+            decode = texture_extraction.convert_texture_to_image
+
+        # The grid fills in as the scan finds textures; clicking a thumbnail opens it in the viewer
+        ThumbnailGrid(scan.textures, decode, scan=scan, title=os.path.basename(filename),
+                      open_texture=lambda index: display_texture(scan.textures, index, scan,
+                                                                 decode if ps2 else None))
 
 
 def main():
     global file_path  # Use the global file_path variable
     root = Tk()
     root.title("Silent Hill 3 Texture Extractor and Importer")
-    root.geometry("900x200")
+    root.geometry("1230x200")
     file_path = ""
 
     import_button = Button(root, text="Convert to .bgra", command=lambda: import_file(root))
     import_button.pack(side=LEFT, padx=10, pady=10)
 
-    extract_button = Button(root, text="Batch Extract Textures", command=lambda: extract_textures(root))
+    # Profile the extract and PS2 exports stage by stage
+    profile = BooleanVar(root, value=False)
+
+    extract_button = Button(root, text="Batch Extract Textures", command=lambda: extract_textures(root, profile))
     extract_button.pack(side=LEFT, padx=10, pady=10)
     
     # add the reimport button
     reimport_button = Button(root, text="Batch Reimport Textures", command=lambda: reimport_textures(root))
     reimport_button.pack(side=LEFT, padx=10, pady=10)
 
+    # add the apply patch button
+    patch_button = Button(root, text="Apply Patch", command=lambda: apply_patch(root))
+    patch_button.pack(side=LEFT, padx=10, pady=10)
+
     # add the ps2_mode button
-    analyze_button = Button(root, text="PS2_Mode", command=lambda: analyze_textures(root))
+    analyze_button = Button(root, text="PS2_Mode", command=lambda: analyze_textures(root, profile))
     analyze_button.pack(side=LEFT, padx=10, pady=10)
     
 
     # add the view texture button
     view_button = Button(root, text="Texture Viewer", command=lambda: view_texture(root))
     view_button.pack(side=LEFT, padx=10, pady=10)
+
+    # add the thumbnail browser button
+    browse_button = Button(root, text="Thumbnail Browser", command=lambda: browse_textures(root))
+    browse_button.pack(side=LEFT, padx=10, pady=10)
+
+    # add the profiling checkbox
+    profile_check = Checkbutton(root, text="Profile", variable=profile)
+    profile_check.pack(side=LEFT, padx=10, pady=10)
     
     root.mainloop()
 
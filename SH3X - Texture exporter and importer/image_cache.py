@@ -0,0 +1,129 @@
+import queue
+import threading
+from collections import OrderedDict
+
+# Decoded image cache for the texture viewer.
+# ImageCache is an LRU cache bounded by the memory of the images it holds.
+# Prefetcher decodes the textures around the one being shown on a background
+# thread, so stepping through an archive only has to swap in a cached image.
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached image for key (marking it as recently used), or None.
+        """
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.size -= image_bytes(old)
+            self._images[key] = img
+            self.size += image_bytes(img)
+            # Evict the least recently used images, but always keep the newest one
+            while self.size > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= image_bytes(evicted)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+
+class Prefetcher:
+    """
+    Serves decoded images of textures[index] from an ImageCache and decodes the
+    neighbours of the last requested index on a background thread.
+    """
+
+    def __init__(self, textures, decode, cache=None, ahead=4, behind=1):
+        self.textures = textures
+        self.decode = decode
+        self.cache = cache if cache is not None else ImageCache()
+        self.ahead = ahead
+        self.behind = behind
+        self._requests = queue.Queue()
+        # Bumped on every request so stale prefetches are dropped
+        self._generation = 0
+        # index -> version, bumped when a texture is replaced so a decode of its old data is dropped
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self, index):
+        """
+        Returns the image for textures[index], decoding it now on a cache miss,
+        and queues its neighbours for prefetching.
+        """
+        img = self.cache.get(index)
+        if img is None:
+            img = self.decode(self.textures[index])
+            self.cache.put(index, img)
+        self.prefetch(index)
+        return img
+
+    def prefetch(self, index):
+        count = len(self.textures)
+        if count == 0:
+            return
+        self._generation += 1
+        neighbours = [(index + i) % count for i in range(1, self.ahead + 1)]
+        neighbours += [(index - i) % count for i in range(1, self.behind + 1)]
+        for neighbour in neighbours:
+            self._requests.put((self._generation, neighbour))
+
+    def replace(self, index, img):
+        """
+        Caches img for textures[index] after the texture was changed (e.g. by
+        an import). A prefetch still decoding the old texture will not
+        overwrite it.
+        """
+        with self._lock:
+            self._versions[index] = self._versions.get(index, 0) + 1
+            self.cache.put(index, img)
+
+    def stop(self):
+        self._stopped = True
+        self._requests.put(None)
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None or self._stopped:
+                return
+            generation, index = request
+            if generation != self._generation or index in self.cache:
+                continue
+            version = self._versions.get(index, 0)
+            try:
+                img = self.decode(self.textures[index])
+            except Exception as e:
+                print(f"Could not prefetch texture {index}: {e}")
+                continue
+            with self._lock:
+                # Skip the result if the texture was replaced while it was being decoded
+                if self._versions.get(index, 0) == version:
+                    self.cache.put(index, img)
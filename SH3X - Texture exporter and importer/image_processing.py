@@ -1,29 +1,16 @@
 import struct
 import os
 from PIL import Image
+from pixel_conversion import bgra_to_rgba, rgba_to_bgra, image_to_bgra
 
 def convert_bgra_to_rgba(bgra_data):
     # Convert BGRA to RGBA
-    rgba_data = b""
-    for i in range(0, len(bgra_data), 4):
-        b = bgra_data[i]
-        g = bgra_data[i + 1]
-        r = bgra_data[i + 2]
-        a = bgra_data[i + 3]
-        rgba_data += struct.pack("<4B", r, g, b, a)
-    return rgba_data
+    return bgra_to_rgba(bgra_data)
 
 
 def convert_rgba_to_bgra(rgba_data):
     # Convert RGBA to BGRA
-    bgra_data = b""
-    for i in range(0, len(rgba_data), 4):
-        r = rgba_data[i]
-        g = rgba_data[i + 1]
-        b = rgba_data[i + 2]
-        a = rgba_data[i + 3]
-        bgra_data += struct.pack("<4B", b, g, r, a)
-    return bgra_data
+    return rgba_to_bgra(rgba_data)
 
 def save_images(file_path, data, width, height):
     # Create a new directory to store extracted data
@@ -70,10 +57,9 @@ def save_images(file_path, data, width, height):
 def import_png(file_path, output_path):
     # Load PNG image as RGBA data
     img = Image.open(file_path)
-    rgba_data = img.tobytes()
 
     # Convert RGBA data to BGRA
-    bgra_data = convert_rgba_to_bgra(rgba_data)
+    bgra_data = image_to_bgra(img)
 
     # Write BGRA data to file
     with open(output_path, "wb") as f:
@@ -4,6 +4,7 @@ import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
 from tkinter import messagebox
+from texture_patch import PatchWriter
 
 def getint32(b, offs=0):
     return struct.unpack('<i', b[offs:offs+4])[0]
@@ -42,6 +43,11 @@ class MFAViewer:
         self.import_button = ttk.Button(root, text="Import New File", command=self.import_file)
         self.import_button.pack()
 
+        # Write imports to a patch file instead of modifying the MFA file
+        self.patch_mode = tk.BooleanVar(value=False)
+        self.patch_check = ttk.Checkbutton(root, text="Save imports as patch file", variable=self.patch_mode)
+        self.patch_check.pack()
+
     def load_mfa(self):
         path = filedialog.askopenfilename()
         if path:
@@ -133,25 +139,24 @@ class MFAViewer:
 
         # Calculate the size difference
         size_difference = len(new_file_data) - original_size
-    
+
+        # Collect the changes as (offset, bytes) writes, applied after the data has been shifted
+        writes = []
+        shift = None
+        tree_updates = []
+
         # If the new file is larger, we need to shift data
         if size_difference > 0:
-            # Update the total byte size and its display in the GUI
-            self.total_bytesize += size_difference
-            self.total_byte_size_label.config(text=f"Total byte size of file: {self.total_bytesize}")
-        
             # Update the total byte size in the MFA data
             total_byte_size_offset = 0xDC
-            self.mfa_data[total_byte_size_offset:total_byte_size_offset + 4] = struct.pack('<I', self.total_bytesize)
-        
-            # Shift the data to make space for the new file
-            self.mfa_data = (self.mfa_data[:data_offset + original_size] +
-                            b'\x00' * size_difference +
-                            self.mfa_data[data_offset + original_size:])
+            writes.append((total_byte_size_offset, struct.pack('<I', self.total_bytesize + size_difference)))
+
+            # Shift the data after the file to make space for the new file
+            shift = (data_offset + original_size, size_difference)
 
             # Update the size in the file entry
             size_offset = data_offset - 0x14
-            self.mfa_data[size_offset:size_offset + 4] = struct.pack('<I', len(new_file_data))
+            writes.append((size_offset, struct.pack('<I', len(new_file_data))))
 
             # Update offsets for subsequent files
             for i in range(file_index + 1, len(self.tree.get_children())):
@@ -167,19 +172,39 @@ class MFAViewer:
                 file_entry_data_offset_pos = self.data_offset_positions[i]
                 
                 # Update the data offset in the MFA data
-                self.mfa_data[file_entry_data_offset_pos:file_entry_data_offset_pos + 4] = struct.pack('<I', new_child_data_offset)
-    
-            
-                # Update the data offset in the treeview
-                self.tree.item(child_id, values=(child_values[0], child_values[1], child_values[2], hex(new_child_data_offset)))
+                writes.append((file_entry_data_offset_pos, struct.pack('<I', new_child_data_offset)))
 
+                # Update the data offset in the treeview
+                tree_updates.append((child_id, (child_values[0], child_values[1], child_values[2], hex(new_child_data_offset))))
 
         elif size_difference < 0:
             messagebox.showerror("Error", "The new file must not be smaller than the original.")
             return
-        else:
-            # If the new file is the same size, just replace the data
-            self.mfa_data[data_offset:data_offset + original_size] = new_file_data
+
+        # Replace the file data
+        writes.append((data_offset, new_file_data))
+
+        if self.patch_mode.get():
+            # Leave the archive untouched and write the changes as a patch file
+            patch_path = filedialog.asksaveasfilename(defaultextension=".sh3patch",
+                                                      filetypes=[("SH3 patch files", "*.sh3patch")])
+            if patch_path:
+                self.write_patch(patch_path, shift, writes)
+                messagebox.showinfo("Success", "Patch written to " + patch_path)
+            return
+
+        if shift:
+            insert_at, size = shift
+            self.mfa_data[insert_at:insert_at] = bytes(size)
+
+            # Update the total byte size and its display in the GUI
+            self.total_bytesize += size_difference
+            self.total_byte_size_label.config(text=f"Total byte size of file: {self.total_bytesize}")
+            for child_id, values in tree_updates:
+                self.tree.item(child_id, values=values)
+
+        for offset, data in writes:
+            self.mfa_data[offset:offset + len(data)] = data
 
         # Confirm successful import
         messagebox.showinfo("Success", "File imported successfully")
@@ -187,6 +212,18 @@ class MFAViewer:
         # Save the modified MFA data back to the file
         with open(self.mfa_path, 'wb') as mfa_file:
             mfa_file.write(self.mfa_data)
+
+    def write_patch(self, patch_path, shift, writes):
+        """
+        Writes the changes of an import as a patch against the MFA file on disk.
+        """
+        target_size = len(self.mfa_data) + (shift[1] if shift else 0)
+        with PatchWriter(patch_path, source_filename=self.mfa_path, target_size=target_size) as patch:
+            if shift:
+                insert_at, size = shift
+                patch.move(insert_at, insert_at + size, len(self.mfa_data) - insert_at)
+            for offset, data in writes:
+                patch.write(offset, data)
             
             
         
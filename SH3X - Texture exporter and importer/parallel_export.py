@@ -0,0 +1,86 @@
+import os
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import profiling
+
+# Runs per-texture export jobs, optionally spread over a process pool.
+# Jobs are submitted in order and their results collected in the same order,
+# so output stays deterministic whatever the worker count. A failing job is
+# reported and skipped instead of aborting the rest of the batch. While a
+# profiler is enabled, each job is profiled in its worker and the stages are
+# merged into the parent's profiler.
+
+
+def resolve_workers(workers):
+    """
+    None or 1 means serial, 0 means one worker per CPU core.
+    """
+    if workers is None:
+        return 1
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _run_job(func, job):
+    try:
+        return func(job), None
+    except Exception as e:
+        return None, f"{e}\n{traceback.format_exc()}"
+
+
+def _run_profiled_job(func, job, trace_memory):
+    profiling.enable(trace_memory)
+    try:
+        result = _run_job(func, job)
+    finally:
+        profiler = profiling.disable()
+    return result, profiler.stages
+
+
+def _collect(future, profiler):
+    if profiler is None:
+        return future.result()
+    result, stages = future.result()
+    profiler.merge(stages)
+    return result
+
+
+def iter_jobs(func, jobs, workers=None):
+    """
+    Calls func(job) for every job and yields (result, error) pairs in job order
+    as they complete. func must be a module level function so it can be sent
+    to worker processes.
+    """
+    workers = resolve_workers(workers)
+    if workers == 1:
+        for job in jobs:
+            yield _run_job(func, job)
+        return
+
+    # Keep a bounded number of jobs in flight so payloads aren't all pickled at once
+    max_pending = workers * 4
+    pending = deque()
+    profiler = profiling.active()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for job in jobs:
+            if profiler is None:
+                pending.append(executor.submit(_run_job, func, job))
+            else:
+                pending.append(executor.submit(_run_profiled_job, func, job, profiler.trace_memory))
+            if len(pending) >= max_pending:
+                yield _collect(pending.popleft(), profiler)
+        while pending:
+            yield _collect(pending.popleft(), profiler)
+
+
+def report_failures(names, results):
+    """
+    Prints the jobs that failed and returns them as a list of (name, error) pairs.
+    """
+    failures = [(name, error) for name, (result, error) in zip(names, results) if error is not None]
+    for name, error in failures:
+        print(f"Failed to export {name}: {error.splitlines()[0]}")
+    return failures
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+
+import ps2_mode
+import texture_extraction
+from archive_reader import ArchiveReader
+from parallel_export import iter_jobs
+from texture_header import MASTER_HEADER_MAGIC, MAX_HEADER_SIZE, PS2_TEXTURE_MAGIC
+from texture_index import iter_or_scan
+
+# Parallel scanning of a single large archive.
+# The file is split into segments that are scanned by worker processes, each
+# mapping the same file (the OS shares the pages between them). A worker
+# validates every signature match whose offset lies in its own segment; it
+# searches on past the segment end by SEGMENT_OVERLAP bytes, at least the
+# longest header, so a match straddling a boundary is found by the segment it
+# starts in. Headers and texture groups that run past the segment are read
+# from the mapping as usual. The candidates of all segments are then merged
+# in offset order, replaying the serial scanner's rule of continuing after
+# each texture, so the result is identical to a serial scan.
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_OVERLAP = MAX_HEADER_SIZE
+
+SCANNERS = {
+    "pc": (MASTER_HEADER_MAGIC, texture_extraction.parse_candidate, texture_extraction.scan_textures),
+    "ps2": (PS2_TEXTURE_MAGIC, ps2_mode.parse_candidate, ps2_mode.scan_textures),
+}
+
+
+def split_segments(size, segment_size=DEFAULT_SEGMENT_SIZE, overlap=SEGMENT_OVERLAP):
+    """
+    Returns (start, end, search_end) for each segment: matches at [start, end)
+    belong to the segment, which is searched up to search_end.
+    """
+    return [(start, min(start + segment_size, size), min(start + segment_size + overlap, size))
+            for start in range(0, size, segment_size)]
+
+
+def scan_segment(job):
+    """
+    Returns (offset, entries, next_offset) for every valid candidate that starts in the segment.
+    """
+    filename, kind, start, end, search_end = job
+    magic, parse_candidate, _ = SCANNERS[kind]
+    candidates = []
+    with ArchiveReader(filename) as reader:
+        offset = reader.find(magic, start, search_end)
+        while offset != -1 and offset < end:
+            entries, next_offset = parse_candidate(reader.buffer, reader.size, offset)
+            if entries:
+                candidates.append((offset, entries, next_offset))
+            offset = reader.find(magic, offset + 1, search_end)
+    return candidates
+
+
+def merge_candidates(candidates):
+    """
+    Merges candidates into the entries a serial scan finds: in offset order,
+    skipping candidates that lie inside a texture that was already accepted
+    (which also drops duplicates).
+    """
+    entries = []
+    position = 0
+    for offset, group, next_offset in sorted(candidates, key=lambda candidate: candidate[0]):
+        if offset < position:
+            continue
+        entries.extend(group)
+        position = next_offset
+    return entries
+
+
+def parallel_scan(filename, kind, workers=0, segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Scans an archive ("pc" or "ps2") with a process pool (0 = one worker per
+    core) and returns the same entries as the serial scanner.
+    """
+    size = os.path.getsize(filename)
+    jobs = [(filename, kind, start, end, search_end)
+            for start, end, search_end in split_segments(size, segment_size)]
+    candidates = []
+    for result, error in iter_jobs(scan_segment, jobs, workers):
+        if error is not None:
+            raise RuntimeError(f"Scanning {filename} failed: {error}")
+        candidates.extend(result)
+    return merge_candidates(candidates)
+
+
+def iter_file_entries(filename, kind, use_index=True, workers=0, segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Yields an archive's entries from the cached index, or from a parallel scan.
+    """
+    yield from iter_or_scan(filename, kind, lambda: parallel_scan(filename, kind, workers, segment_size),
+                            use_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel archive scan; checks itself against the serial scan.")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="Worker processes (0 = one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic archives")
+    args = parser.parse_args()
+    # The check lives with the other tests; imported here since test_functions imports this module
+    from test_functions import check_parallel_scan
+    return 0 if check_parallel_scan(args.workers, args.seed) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
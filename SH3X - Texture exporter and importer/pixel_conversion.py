@@ -0,0 +1,103 @@
+import struct
+import time
+import numpy as np
+from PIL import Image
+
+# Shared pixel conversion helpers.
+# SH3 PC textures are stored as 32-bit BGRA, Pillow works in RGBA. Every
+# conversion here works on whole buffers (NumPy channel swaps or Pillow's raw
+# "BGRA" decoder) instead of looping over pixels in Python.
+
+# Channel order used to swap between BGRA and RGBA (the swap is symmetric)
+_SWAP_RB = [2, 1, 0, 3]
+
+
+def _as_pixels(data):
+    """
+    Returns a (pixels, 4) uint8 view over any bytes-like object without copying.
+    """
+    pixels = np.frombuffer(data, dtype=np.uint8)
+    if pixels.size % 4:
+        raise ValueError(f"Pixel data length ({pixels.size}) is not a multiple of 4 bytes")
+    return pixels.reshape(-1, 4)
+
+
+def swap_red_blue(data):
+    """
+    Swaps the red and blue channels of 32-bit pixel data (BGRA <-> RGBA).
+    """
+    return _as_pixels(data)[:, _SWAP_RB].tobytes()
+
+
+def bgra_to_rgba(bgra_data):
+    return swap_red_blue(bgra_data)
+
+
+def rgba_to_bgra(rgba_data):
+    return swap_red_blue(rgba_data)
+
+
+def bgra_to_image(bgra_data, width, height):
+    """
+    Decodes BGRA pixel data straight into an RGBA Pillow Image.
+    """
+    return Image.frombuffer("RGBA", (width, height), bgra_data, "raw", "BGRA", 0, 1).copy()
+
+
+def image_to_bgra(img):
+    """
+    Encodes a Pillow Image as BGRA pixel data, converting it to RGBA first if needed.
+    """
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    return img.tobytes("raw", "BGRA")
+
+
+# Reference copy of the old per-pixel loop from image_processing, used by the benchmark below
+def _legacy_bgra_to_rgba(bgra_data):
+    rgba_data = b""
+    for i in range(0, len(bgra_data), 4):
+        b = bgra_data[i]
+        g = bgra_data[i + 1]
+        r = bgra_data[i + 2]
+        a = bgra_data[i + 3]
+        rgba_data += struct.pack("<4B", r, g, b, a)
+    return rgba_data
+
+
+def benchmark(width=256, height=256, repeat=3):
+    """
+    Times the buffer based conversions against the old per-pixel loop and
+    checks that every path produces byte-identical output.
+    """
+    bgra_data = np.random.default_rng(0).integers(0, 256, width * height * 4, dtype=np.uint8).tobytes()
+
+    start = time.perf_counter()
+    expected = _legacy_bgra_to_rgba(bgra_data)
+    legacy_time = time.perf_counter() - start
+
+    results = {"legacy loop": legacy_time}
+    for name, func in (("numpy swap", lambda: bgra_to_rgba(bgra_data)),
+                       ("pillow decoder", lambda: bgra_to_image(bgra_data, width, height).tobytes())):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if output != expected:
+            raise AssertionError(f"{name} output differs from the legacy conversion")
+        results[name] = best
+
+    roundtrip = image_to_bgra(bgra_to_image(bgra_data, width, height))
+    if roundtrip != bgra_data or rgba_to_bgra(expected) != bgra_data:
+        raise AssertionError("BGRA -> RGBA -> BGRA round trip is not byte-identical")
+
+    print(f"BGRA -> RGBA conversion of a {width}x{height} texture:")
+    for name, elapsed in results.items():
+        print(f"  {name:15s} {elapsed * 1000:10.2f} ms  ({legacy_time / elapsed:8.1f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,244 @@
+import contextlib
+import threading
+import time
+import tracemalloc
+
+import atomic_io
+
+# Opt-in stage profiling of the texture pipeline.
+# The pipeline marks its stages (scan, palette, unswizzle, convert, encode,
+# write, ...) with profiling.stage() and counts the work done in them (bytes
+# scanned, textures parsed, pixels converted, bytes encoded and written). While
+# no profiler is enabled these calls do nothing, so the instrumentation stays
+# in place at no real cost. An enabled profiler sums the wall time, calls and
+# counters of every stage and, with tracemalloc, the peak memory a stage
+# allocated on top of what was allocated when it started. Nested stages are
+# counted in their parent as well. Peaks are process wide, so stages running
+# on several threads at once see each other's allocations. Stages run in
+# worker processes are profiled there and merged back by parallel_export.
+
+REPORT_VERSION = 1
+
+_active = None
+
+
+class Profiler:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracing = False
+        self._start = None
+        self.seconds = 0.0
+        self.peak_memory = 0
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self._start
+        if tracemalloc.is_tracing():
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = {"calls": 0, "seconds": 0.0, "peak_memory": 0}
+        return record
+
+    def _memory_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push_memory(self):
+        # Each open stage keeps [traced memory at its start, highest traced memory seen so far]
+        stack = self._memory_stack()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        stack.append([current, current])
+
+    def _pop_memory(self):
+        stack = self._memory_stack()
+        start, highest = stack.pop()
+        highest = max(highest, tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][1] = max(stack[-1][1], highest)
+        self.peak_memory = max(self.peak_memory, highest)
+        return highest - start
+
+    @contextlib.contextmanager
+    def stage(self, name, **counters):
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            self._push_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = self._pop_memory() if tracing else 0
+            with self._lock:
+                record = self._record(name)
+                record["calls"] += 1
+                record["seconds"] += seconds
+                record["peak_memory"] = max(record["peak_memory"], peak)
+                for key, value in counters.items():
+                    record[key] = record.get(key, 0) + value
+
+    def count(self, name, **counters):
+        """
+        Adds to the counters of a stage without timing anything.
+        """
+        with self._lock:
+            record = self._record(name)
+            for key, value in counters.items():
+                record[key] = record.get(key, 0) + value
+
+    def merge(self, stages):
+        """
+        Adds the stages of another profiler (e.g. one run in a worker process).
+        """
+        with self._lock:
+            for name, other in stages.items():
+                record = self._record(name)
+                for key, value in other.items():
+                    if key == "peak_memory":
+                        record[key] = max(record[key], value)
+                    else:
+                        record[key] = record.get(key, 0) + value
+
+    def report(self):
+        """
+        Returns the profile as a JSON-serializable dict, with the rate of every
+        counter (per second of the stage's own time) added to each stage.
+        """
+        stages = {}
+        for name, record in self.stages.items():
+            stage = dict(record)
+            if record["seconds"] > 0:
+                for key, value in record.items():
+                    if key not in ("calls", "seconds", "peak_memory"):
+                        stage[f"{key}_per_second"] = value / record["seconds"]
+            stages[name] = stage
+        return {
+            "version": REPORT_VERSION,
+            "seconds": self.seconds,
+            "trace_memory": self.trace_memory,
+            "peak_memory": self.peak_memory,
+            "stages": stages,
+        }
+
+    def summary(self):
+        """
+        Returns a short text table of the stages, slowest first.
+        """
+        lines = [f"Profile: {self.seconds:.2f}s wall time"
+                 + (f", peak traced memory {self.peak_memory / 1048576:.1f} MB" if self.trace_memory else "")]
+        for name, record in sorted(self.stages.items(), key=lambda item: -item[1]["seconds"]):
+            line = f"  {name:<12} {record['seconds']:8.3f}s {record['calls']:7d} calls"
+            if self.trace_memory:
+                line += f" {record['peak_memory'] / 1048576:8.1f} MB peak"
+            for key, value in record.items():
+                if key in ("calls", "seconds", "peak_memory"):
+                    continue
+                line += f"  {key}={value}"
+                if record["seconds"] > 0:
+                    if key.startswith("bytes"):
+                        line += f" ({value / 1048576 / record['seconds']:.1f} MB/s)"
+                    else:
+                        line += f" ({value / record['seconds']:.0f}/s)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        atomic_io.atomic_write_json(path, self.report(), indent=1)
+
+
+def enable(trace_memory=True):
+    """
+    Starts a new profiler that the pipeline's stages record into and returns it.
+    """
+    global _active
+    _active = Profiler(trace_memory)
+    _active.start()
+    return _active
+
+
+def disable():
+    """
+    Stops the active profiler and returns it (None if none was enabled).
+    """
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def active():
+    return _active
+
+
+def stage(name, **counters):
+    """
+    Times a stage of the active profiler: with profiling.stage("encode", bytes_encoded=n): ...
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name, **counters)
+
+
+def count(name, **counters):
+    if _active is not None:
+        _active.count(name, **counters)
+
+
+def timed_iter(name, iterable):
+    """
+    Yields the items of iterable, timing only the time spent producing them
+    (not the consumer's) as stage name. Returns iterable itself when profiling
+    is off.
+    """
+    if _active is None:
+        return iterable
+    return _timed_iter(_active, name, iterable)
+
+
+def _timed_iter(profiler, name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with profiler.stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+@contextlib.contextmanager
+def profiled(report_path=None, enabled=True, trace_memory=True):
+    """
+    Profiles the body of the with statement and yields the profiler (None when
+    not enabled). The JSON report is written to report_path afterwards.
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = enable(trace_memory)
+    try:
+        yield profiler
+    finally:
+        disable()
+        if report_path is not None:
+            profiler.write_report(report_path)
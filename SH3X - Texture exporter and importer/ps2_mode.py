@@ -5,180 +5,137 @@ from PIL import Image
 from typing import List, Tuple
 import numpy as np
 import logging
-
-def process_palette_data(palette_data, palette_data_size, entry_size, bypp):
+from archive_reader import ArchiveReader
+from texture_index import iter_or_scan
+from parallel_export import iter_jobs, report_failures
+from atomic_io import atomic_save_image, atomic_write_bytes
+from ps2_palette import palette_to_rgb
+from texture_record import Texture
+from raw_dump import RawDumpSink
+from ps2_swizzle import TYPE2, swizzle4, swizzle8, unswizzle4_to_8, unswizzle8
+import profiling
+from texture_header import (PS2_TEXTURE_MAGIC, PALETTE_HEADER_SIZE, read_texture_header,
+                            read_palette_header, palette_header_offset, texture_data_offset)
+
+def parse_candidate(buf, size, offset):
     """
-    Processes the raw palette data and returns a list of RGBA tuples.
+    Parses the texture at a PS2 signature match. Returns (entries, next_offset):
+    the texture's entry and the offset after its data and palette, or no
+    entries and offset + 1 if the header or palette header fails validation.
     """
-    # Each block is 256 bytes; actual data is entry_size bytes
-    nBlocks = palette_data_size // 256
-    colorsPerBlock = entry_size // bypp
-    palette = []
-
-    for block in range(nBlocks):
-        block_start = block * 256
-        block_end = block_start + entry_size
+    header = read_texture_header(buf, offset, size)
+    if header is None:
+        return [], offset + 1
+    palette_header = read_palette_header(buf, palette_header_offset(header), size)
+    if palette_header is None:
+        return [], offset + 1
+
+    data_offset = texture_data_offset(header)
+    palette_data_offset = palette_header.offset + PALETTE_HEADER_SIZE
+    entry = {
+        "header_offset": offset,
+        "header_size": header.header_size,
+        "width": header.width,
+        "height": header.height,
+        "bpp": header.bpp,
+        "offset": data_offset,
+        "data_size": header.data_size,
+        "total_size": header.total_size,
+        "palette_header_offset": palette_header.offset,
+        "palette_data_offset": palette_data_offset,
+        "palette_data_size": palette_header.data_size,
+        "bypp": palette_header.bypp,
+        "entry_size": palette_header.entry_size,
+    }
+    # Continue after the texture data and palette
+    return [entry], max(data_offset + header.data_size, palette_data_offset + palette_header.data_size)
+
+
+def iter_entries(reader):
+    """
+    Scans a PS2 file for texture headers and yields one entry per texture with
+    its header, data and palette locations as soon as it is found. No texture
+    or palette data is read. Signature matches whose header or palette header
+    fails validation are skipped, and after a texture the search resumes past
+    its data and palette, so the file is searched only once.
+    """
+    buf = reader.buffer
+    size = reader.size
+    # Search for the texture header pattern
+    texture_header_offset = reader.find(PS2_TEXTURE_MAGIC)
+    while texture_header_offset != -1:
+        entries, next_offset = parse_candidate(buf, size, texture_header_offset)
+        yield from entries
+        # Find the next texture header
+        texture_header_offset = reader.find(PS2_TEXTURE_MAGIC, next_offset)
+
+
+def scan_textures(reader):
+    """
+    Returns the entries of every texture in a PS2 file.
+    """
+    return list(iter_entries(reader))
 
-        # Ensure the block_end does not exceed the length of palette_data
-        if block_end > len(palette_data):
-            print(f"Warning: Block end ({block_end}) exceeds palette data length ({len(palette_data)})!")
-            break
 
-        block_data = palette_data[block_start:block_end]
+def iter_file_entries(filename, use_index=True):
+    """
+    Yields the PS2 texture entries of a file while the scan advances, using the
+    cached index when it is still valid.
+    """
+    with ArchiveReader(filename) as reader:
+        yield from iter_or_scan(filename, "ps2", lambda: iter_entries(reader), use_index)
 
-        # Convert block_data bytes to list of tuples representing colors (RGBA format)
-        block_palette = [
-            (block_data[i], block_data[i + 1], block_data[i + 2], block_data[i + 3])  # RGBA
-            for i in range(0, len(block_data), bypp)
-        ]
-        palette.extend(block_palette)
 
-    # Swapping colors logic
-    swapDistance = 32
-    swapSize = 8
-    if len(palette) > 8:
-        for i in range(8, len(palette) - swapSize, swapDistance):
-            swapBlock = i + swapSize
-            if swapBlock + swapSize > len(palette):
-                print("Palette doesn't have enough colors left for swapping.")
-                break
-            palette[i:swapBlock], palette[swapBlock:swapBlock+swapSize] = palette[swapBlock:swapBlock+swapSize], palette[i:swapBlock]
+def iter_textures(filenames, use_index=True):
+    """
+    Yields a Texture for every texture in the PS2 files as the scan finds it.
+    Texture data and the processed palette are read on first access. Each
+    file is closed once its scan is done (textures used after that open it
+    again), or when the generator is closed.
+    """
+    index = 0
+    for filename in filenames:
+        with ArchiveReader(filename) as reader:
+            for entry in iter_or_scan(filename, "ps2", lambda: iter_entries(reader), use_index):
+                texture_name = f"{os.path.basename(filename)}_texture_{entry['offset']:x}.bin".replace(":", "_")
+                yield Texture(entry, texture_name, reader, index)
+                index += 1
 
-    return palette
 
-def analyze_textures(filenames):
+def analyze_textures(filenames, use_index=True, dump_dir=None):
+    """
+    Returns the Textures of the PS2 files. With dump_dir the raw texture and
+    palette data is also written there as texture_<offset>.bin and
+    palette_<offset>.bin files.
+    """
+    dump = RawDumpSink(dump_dir) if dump_dir is not None else None
     textures = []
-    for filename in filenames:
-        with open(filename, "rb") as f:
-            # Search for the texture header pattern
-            texture_header_pattern = b"\xFF\xFF\xFF\xFF\x00\x00\x00\x00\x00"
-            data = f.read()
-            texture_header_offset = data.find(texture_header_pattern)
-            while texture_header_offset != -1:
-                # Seek to the texture header
-                f.seek(texture_header_offset)
-                # Read the texture header
-                texture_header = f.read(0x20)
-                # Check the pattern to determine the header size
-                if texture_header[12:16] == b"\x20\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x08\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x20\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x08\x20\x00\x00":
-                    header_size = 80
-                elif texture_header[12:16] == b"\x04\x20\x00\x00":
-                    header_size = 112
-                else:
-                    header_size = 80
-                # Calculate the offset of the texture header
-                header_offset = f.tell() - 0x20
-                # Read the remaining bytes of the texture header
-                texture_header += f.read(header_size - 0x20)
-
-                # Parse the values from the texture header
-                width = struct.unpack("<H", texture_header[8:10])[0]
-                height = struct.unpack("<H", texture_header[10:12])[0]
-                bpp = struct.unpack("<B", texture_header[12:13])[0]
-                data_size = struct.unpack("<I", texture_header[16:20])[0]
-                total_size = struct.unpack("<I", texture_header[20:24])[0]
-                data_offset = struct.unpack("<I", texture_header[4:8])[0]
-
-                # Read the texture data
-                texture_data_offset = f.tell()
-                f.seek(texture_data_offset)
-                texture_data = f.read(data_size)
-
-                # Read the palette header
-                palette_header_offset = texture_data_offset + data_size - (0x20 if header_size == 112 else 0)
-                f.seek(palette_header_offset)
-                palette_header = f.read(0x30)
-
-                # Extract relevant values from the palette header
-                palette_data_size = struct.unpack("<I", palette_header[0:4])[0]
-                bypp = struct.unpack("<B", palette_header[12:13])[0]
-                entry_size = struct.unpack("<B", palette_header[14:15])[0]
-
-                # Read the palette data
-                palette_data_offset = palette_header_offset + 0x30
-                f.seek(palette_data_offset)
-                raw_palette_data = f.read(palette_data_size)
-                palette_data = raw_palette_data
-
-                # Process the palette data
-                palette = process_palette_data(palette_data, palette_data_size, entry_size, bypp)
-
-                # Add the texture information to the list of textures
-                texture = {
-                    "index": len(textures),
-                    "width": width,
-                    "palette": palette,
-                    "height": height,
-                    "bpp": bpp,
-                    "data_size": data_size,
-                    "data": texture_data,
-                    "offset": texture_data_offset,
-                    "palette_data": palette_data,
-                    "bypp": bypp,
-                    "entry_size": entry_size,
-                    "palette_header_info": (palette_data_size, bypp),
-                    "total_size": total_size,
-                    "filename": f"{os.path.basename(filename)}_texture_{texture_data_offset:x}.bin".replace(":", "_")
-                }
-                textures.append(texture)
-
-                # Create the output directory if it doesn't exist
-                if not os.path.exists("output"):
-                    os.mkdir("output")
-                # Write the texture data to a separate file
-                with open(f"output/texture_{texture_data_offset:x}.bin", "wb") as texture_file:
-                    texture_file.write(texture_data)
-                # Write the palette data to a separate file
-                with open(f"output/palette_{palette_data_offset:x}.bin", "wb") as palette_file:
-                    palette_file.write(palette_data)
-
-                # Find the next texture header
-                texture_header_offset = data.find(texture_header_pattern, texture_header_offset + 1)
-                if texture_header_offset == -1:
-                    break
+    for texture in iter_textures(filenames, use_index):
+        textures.append(texture)
+        if dump is not None:
+            dump.write(texture)
 
     return textures
 
 def unswizzle_8_to_32(p_in_texels, width, height):
-    p_swiz_texels = bytearray(width * height)
-
-    for y in range(height):
-        for x in range(width):
-            block_location = (y & ~0xf) * width + (x & ~0xf) * 2
-            swap_selector = (((y + 2) >> 2) & 0x1) * 4
-            pos_y = (((y & ~3) >> 1) + (y & 1)) & 0x7
-            column_location = pos_y * width * 2 + ((x + swap_selector) & 0x7) * 4
-
-            byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)  # 0, 1, 2, 3
+    # One gather through the cached permutation table (see ps2_swizzle)
+    return unswizzle8(p_in_texels, width, height)
 
-            p_swiz_texels[y * width + x] = p_in_texels[block_location + column_location + byte_num]
-
-    return bytes(p_swiz_texels)
-
-def unswizzle4(p_In_Texels, width, height):
-    # Convert the 4bpp input data into 8bpp
-    p_Converted_Texels = bytearray(width * height)
-    for i in range(width * height // 2):
-        index = p_In_Texels[i]
-        id2 = (index >> 4) & 0xf
-        id1 = index & 0xf
-        p_Converted_Texels[i * 2] = id1
-        p_Converted_Texels[i * 2 + 1] = id2
+def swizzle_8_to_32(p_in_texels, width, height):
+    """
+    Inverse of unswizzle_8_to_32: rearranges linear 8bpp texels into the PSMCT32 layout.
+    """
+    return swizzle8(p_in_texels, width, height)
 
-    # Use your 8bpp unswizzling function on the converted texels
-    p_Unswizzled_Texels = unswizzle_8_to_32(p_Converted_Texels, width, height)
+def unswizzle4(p_In_Texels, width, height, layout=TYPE2):
+    # Unswizzle the 4bpp texels into one texel per byte (see ps2_swizzle for the layouts)
+    return unswizzle4_to_8(p_In_Texels, width, height, layout)
 
-    return bytes(p_Unswizzled_Texels)
+def swizzle4_from_8(p_in_texels, width, height, layout=TYPE2):
+    """
+    Inverse of unswizzle4: packs one texel per byte back into swizzled 4bpp data.
+    """
+    return swizzle4(p_in_texels, width, height, layout, packed=False)
 
 def unswizzle_texture(texture_data, width, height, bpp):
     if bpp == 8:
@@ -188,41 +145,93 @@ def unswizzle_texture(texture_data, width, height, bpp):
     else:
         raise ValueError(f"Unsupported bpp value: {bpp}")
 
-def unswizzle_and_save(textures, output_dir):
-    for texture in textures:
-        texture_data = texture["data"]
-        width = texture["width"]
-        height = texture["height"]
-        filename = texture["filename"]
-        palette = texture["palette"]
-        bpp = texture["bpp"]
+def swizzle_texture(texel_data, width, height, bpp):
+    """
+    Inverse of unswizzle_texture: swizzles linear texels (one per byte) back
+    into the layout stored in PS2 files.
+    """
+    if bpp == 8:
+        return swizzle_8_to_32(texel_data, width, height)
+    elif bpp == 4:
+        return swizzle4_from_8(texel_data, width, height)
+    else:
+        raise ValueError(f"Unsupported bpp value: {bpp}")
+
+def unswizzled_to_image(unswizzled_data, width, height, palette, bpp):
+    """
+    Builds a Pillow Image from unswizzled texel data and its palette.
+    """
+    if bpp in (4, 8):
+        # Create an Image with mode 'P' (palettized)
+        image = Image.frombytes('P', (width, height), unswizzled_data)
+        # Use the RGB channels of the palette
+        flat_palette = palette_to_rgb(palette)
+        # Ensure the palette has 768 values (256 colors * 3 channels)
+        if len(flat_palette) < 768:
+            flat_palette += bytes(768 - len(flat_palette))
+        image.putpalette(flat_palette)
+    else:
+        # For other bpp values, handle accordingly (e.g., 'L' mode for grayscale)
+        image = Image.frombytes('L', (width, height), unswizzled_data)
+    return image
+
+
+def convert_texture_to_image(texture):
+    """
+    Unswizzles a PS2 texture and returns it as a palettized Pillow Image.
+    """
+    unswizzled_data = unswizzle_texture(texture.data, texture.width, texture.height, texture.bpp)
+    return unswizzled_to_image(unswizzled_data, texture.width, texture.height, texture.palette, texture.bpp)
+
 
-        # Unswizzle the texture data
+def raw_path(filename, output_dir):
+    return os.path.join(output_dir, f"raw_unswizzled_{filename}.bin")
+
+
+def png_path(filename, output_dir):
+    return os.path.join(output_dir, f"output_{filename}.png")
+
+
+def _unswizzle_and_save_one(job):
+    # Runs in a worker process: unswizzle one texture and save it as PNG
+    texture_data, width, height, filename, palette, bpp, output_dir = job
+
+    # Unswizzle the texture data
+    with profiling.stage("unswizzle", bytes_unswizzled=len(texture_data)):
         unswizzled_data = unswizzle_texture(texture_data, width, height, bpp)
 
-        if unswizzled_data:
-            # Save the raw unswizzled data
-            with open(os.path.join(output_dir, f"raw_unswizzled_{filename}.bin"), "wb") as f:
-                f.write(unswizzled_data)
-
-            if bpp in (4, 8):
-                # Create an Image with mode 'P' (palettized)
-                image = Image.frombytes('P', (width, height), unswizzled_data)
-                # Flatten the palette to a list
-                flat_palette = []
-                for color in palette:
-                    flat_palette.extend(color[:3])  # Use RGB channels
-                # Ensure the palette has 768 values (256 colors * 3 channels)
-                if len(flat_palette) < 768:
-                    flat_palette.extend([0] * (768 - len(flat_palette)))
-                image.putpalette(flat_palette)
-            else:
-                # For other bpp values, handle accordingly (e.g., 'L' mode for grayscale)
-                image = Image.frombytes('L', (width, height), unswizzled_data)
-
-            # Save the image as a PNG file
-            output_path = os.path.join(output_dir, f"output_{filename}.png")
-            image.save(output_path, format="PNG")
+    if unswizzled_data:
+        # Save the raw unswizzled data
+        atomic_write_bytes(raw_path(filename, output_dir), unswizzled_data)
 
-    print(f"All textures unswizzled and saved to: {output_dir}")
+        with profiling.stage("convert", pixels_converted=width * height):
+            image = unswizzled_to_image(unswizzled_data, width, height, palette, bpp)
 
+        # Save the image as a PNG file
+        atomic_save_image(image, png_path(filename, output_dir))
+    return filename
+
+
+def unswizzle_and_save(textures, output_dir, workers=None, progress=None):
+    """
+    Unswizzles textures and saves them as PNG files in output_dir. workers > 1
+    spreads the work over a process pool (0 = one worker per core).
+    progress(texture, error) is called as each texture completes. Returns the
+    (filename, error) pairs of textures that failed to export.
+    """
+    # The textures are walked more than once (jobs, progress, failures), so a generator is read into a list
+    textures = list(textures)
+    jobs = (
+        (bytes(texture.data), texture.width, texture.height, texture.filename,
+         texture.palette, texture.bpp, output_dir)
+        for texture in textures
+    )
+    results = []
+    for texture, result in zip(textures, iter_jobs(_unswizzle_and_save_one, jobs, workers)):
+        results.append(result)
+        if progress is not None:
+            progress(texture, result[1])
+    failures = report_failures([texture["filename"] for texture in textures], results)
+
+    print(f"All textures unswizzled and saved to: {output_dir}")
+    return failures
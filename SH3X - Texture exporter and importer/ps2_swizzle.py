@@ -0,0 +1,282 @@
+import functools
+import time
+import numpy as np
+
+# PS2 8bpp and 4bpp texture swizzling.
+# 8bpp textures are stored in the GS PSMCT32 layout: every 16x16 block of
+# texels is spread over columns of 32-bit words. Where a texel ends up depends
+# only on its position and the texture's width and height, so the address
+# math is done once per size with NumPy into a permutation table (kept in a
+# small LRU cache), and each texture is then unswizzled with a single gather
+# or swizzled with a single scatter.
+#
+# 4bpp textures come in two layouts. Type 1 is Sparky's PSMT4 layout (the
+# texels uploaded as a 32-bit texture of width height/2 and height width/4).
+# Type 2 expands the nibbles to one texel per byte and runs them through the
+# 8bpp swizzle. Either way every texel is one nibble moved to another nibble
+# position, so 4bpp data is unpacked to nibbles (low nibble first), permuted
+# through a cached nibble table and packed again.
+
+# Number of (width, height) permutation tables kept
+SWIZZLE_CACHE_SIZE = 64
+
+# 4bpp layouts
+TYPE1 = 1
+TYPE2 = 2
+
+
+@functools.lru_cache(maxsize=SWIZZLE_CACHE_SIZE)
+def swizzle8_indices(width, height):
+    """
+    Returns, for every texel of a linear width x height 8bpp texture (row
+    major), its offset in the swizzled data, as a read-only NumPy array.
+    """
+    y, x = np.indices((height, width), dtype=np.intp)
+    block_location = (y & ~0xf) * width + (x & ~0xf) * 2
+    swap_selector = (((y + 2) >> 2) & 0x1) * 4
+    pos_y = (((y & ~3) >> 1) + (y & 1)) & 0x7
+    column_location = pos_y * width * 2 + ((x + swap_selector) & 0x7) * 4
+    byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)  # 0, 1, 2, 3
+
+    indices = (block_location + column_location + byte_num).ravel()
+    indices.flags.writeable = False
+    return indices
+
+
+def _checked_indices(width, height, size):
+    indices = swizzle8_indices(width, height)
+    if indices.size and indices.max() >= size:
+        raise IndexError(f"A {width}x{height} 8bpp swizzle needs {indices.max() + 1} bytes, got {size}")
+    return indices
+
+
+def unswizzle8(data, width, height):
+    """
+    Unswizzles 8bpp texel data from the PSMCT32 layout into linear rows.
+    """
+    texels = np.frombuffer(data, dtype=np.uint8)
+    return texels[_checked_indices(width, height, texels.size)].tobytes()
+
+
+def swizzle8(data, width, height):
+    """
+    Swizzles linear 8bpp texel rows into the PSMCT32 layout (inverse of unswizzle8).
+    """
+    indices = _checked_indices(width, height, width * height)
+    swizzled = np.zeros(width * height, dtype=np.uint8)
+    swizzled[indices] = np.frombuffer(data, dtype=np.uint8, count=width * height)
+    return swizzled.tobytes()
+
+
+def unpack4(data, count=None):
+    """
+    Expands 4bpp data (low nibble first) into a uint8 array of one texel per byte.
+    """
+    packed = np.frombuffer(data, dtype=np.uint8)
+    if count is not None:
+        packed = packed[:(count + 1) // 2]
+    texels = np.empty(packed.size * 2, dtype=np.uint8)
+    texels[0::2] = packed & 0xf
+    texels[1::2] = packed >> 4
+    return texels if count is None else texels[:count]
+
+
+def pack4(texels):
+    """
+    Packs texels (one per byte, values 0-15) into 4bpp bytes, low nibble first.
+    """
+    texels = np.asarray(texels, dtype=np.uint8)
+    if texels.size % 2:
+        texels = np.append(texels, np.uint8(0))
+    return ((texels[0::2] & 0xf) | (texels[1::2] << 4)).astype(np.uint8).tobytes()
+
+
+@functools.lru_cache(maxsize=SWIZZLE_CACHE_SIZE)
+def swizzle4_indices(width, height, layout=TYPE2):
+    """
+    Returns, for every texel of a linear width x height 4bpp texture, the
+    index of its nibble in the swizzled data (nibble 2n is the low nibble of
+    byte n), as a read-only NumPy array.
+    """
+    if layout == TYPE2:
+        return swizzle8_indices(width, height)
+    if layout != TYPE1:
+        raise ValueError(f"Unknown 4bpp layout: {layout}")
+
+    y, x = np.indices((height, width), dtype=np.intp)
+    pages_horz = (width + 127) // 128
+    pages_vert = (height + 127) // 128
+    page_number = ((y & ~0x7f) // 128) * pages_horz + (x & ~0x7f) // 128
+    page32_y = (page_number // pages_vert) * 32
+    page32_x = (page_number % pages_vert) * 64
+    page_location = page32_y * height * 2 + page32_x * 4
+
+    loc_x = x & 0x7f
+    loc_y = y & 0x7f
+    block_location = ((loc_x & ~0x1f) >> 1) * height + (loc_y & ~0xf) * 2
+    swap_selector = (((y + 2) >> 2) & 0x1) * 4
+    pos_y = (((y & ~3) >> 1) + (y & 1)) & 0x7
+    column_location = pos_y * height * 2 + ((x + swap_selector) & 0x7) * 4
+
+    byte_num = (x >> 3) & 3  # 0, 1, 2, 3
+    bits_set = (y >> 1) & 1  # 0, 1 (lower/upper 4 bits)
+    pos = page_location + block_location + column_location + byte_num
+
+    indices = (pos * 2 + bits_set).ravel()
+    indices.flags.writeable = False
+    return indices
+
+
+def _checked_nibble_indices(width, height, layout, nibbles):
+    indices = swizzle4_indices(width, height, layout)
+    if indices.size and indices.max() >= nibbles:
+        raise IndexError(f"A {width}x{height} type {layout} 4bpp swizzle needs {(indices.max() + 2) // 2} bytes, "
+                         f"got {nibbles // 2}")
+    return indices
+
+
+def unswizzle4_to_8(data, width, height, layout=TYPE2):
+    """
+    Unswizzles 4bpp texel data into linear rows of one texel per byte.
+    """
+    nibbles = unpack4(data)
+    return nibbles[_checked_nibble_indices(width, height, layout, nibbles.size)].tobytes()
+
+
+def unswizzle4(data, width, height, layout=TYPE2):
+    """
+    Unswizzles 4bpp texel data into linear 4bpp rows (low nibble first).
+    """
+    nibbles = unpack4(data)
+    return pack4(nibbles[_checked_nibble_indices(width, height, layout, nibbles.size)])
+
+
+def swizzle4(data, width, height, layout=TYPE2, packed=True):
+    """
+    Swizzles linear 4bpp texels into the given layout (inverse of unswizzle4).
+    With packed=False the input holds one texel per byte, as returned by
+    unswizzle4_to_8. Returns packed 4bpp data.
+    """
+    count = width * height
+    texels = unpack4(data, count) if packed else np.frombuffer(data, dtype=np.uint8, count=count) & 0xf
+    indices = _checked_nibble_indices(width, height, layout, count + count % 2)
+    swizzled = np.zeros(count + count % 2, dtype=np.uint8)
+    swizzled[indices] = texels
+    return pack4(swizzled)
+
+
+# Reference copy of the old per-texel loop from ps2_mode, used by the benchmark below
+def _legacy_unswizzle8(p_in_texels, width, height):
+    p_swiz_texels = bytearray(width * height)
+
+    for y in range(height):
+        for x in range(width):
+            block_location = (y & ~0xf) * width + (x & ~0xf) * 2
+            swap_selector = (((y + 2) >> 2) & 0x1) * 4
+            pos_y = (((y & ~3) >> 1) + (y & 1)) & 0x7
+            column_location = pos_y * width * 2 + ((x + swap_selector) & 0x7) * 4
+
+            byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)  # 0, 1, 2, 3
+
+            p_swiz_texels[y * width + x] = p_in_texels[block_location + column_location + byte_num]
+
+    return bytes(p_swiz_texels)
+
+
+# Reference copy of Sparky's 4bpp type 1 loop from ps2textures, used by the self-check below
+def _legacy_unswizzle4_type1(pInTexels, width, height):
+    pSwizTexels = bytearray(width * height // 2)
+    for y in range(height):
+        for x in range(width):
+            index = y * width + x
+            pageX = x & (~0x7f)
+            pageY = y & (~0x7f)
+            pages_horz = (width + 127) // 128
+            pages_vert = (height + 127) // 128
+            page_number = (pageY // 128) * pages_horz + (pageX // 128)
+            page32Y = (page_number // pages_vert) * 32
+            page32X = (page_number % pages_vert) * 64
+            page_location = page32Y * height * 2 + page32X * 4
+            locX = x & 0x7f
+            locY = y & 0x7f
+            block_location = ((locX & (~0x1f)) >> 1) * height + (locY & (~0xf)) * 2
+            swap_selector = (((y + 2) >> 2) & 0x1) * 4
+            posY = (((y & (~3)) >> 1) + (y & 1)) & 0x7
+            column_location = posY * height * 2 + ((x + swap_selector) & 0x7) * 4
+            byte_num = (x >> 3) & 3
+            bits_set = (y >> 1) & 1
+            pos = page_location + block_location + column_location + byte_num
+            if bits_set & 1:
+                uPen = (pInTexels[pos] >> 4) & 0xf
+            else:
+                uPen = pInTexels[pos] & 0xf
+            pix = pSwizTexels[index >> 1]
+            if index & 1:
+                pSwizTexels[index >> 1] = ((uPen << 4) & 0xf0) | (pix & 0xf)
+            else:
+                pSwizTexels[index >> 1] = (pix & 0xf0) | (uPen & 0xf)
+    return bytes(pSwizTexels)
+
+
+# Reference copy of the 4bpp type 2 loop (nibble expand, 8bpp unswizzle, repack) from broken/unswizzle 4bpp.py
+def _legacy_unswizzle4_type2(buffer, width, height):
+    pixels = bytearray(width * height)
+    for i in range(width * height // 2):
+        pixels[i * 2] = buffer[i] & 0xf
+        pixels[i * 2 + 1] = (buffer[i] >> 4) & 0xf
+    newPixels = _legacy_unswizzle8(pixels, width, height)
+    result = bytearray(width * height // 2)
+    for i in range(width * height // 2):
+        result[i] = ((newPixels[i * 2 + 1] << 4) | newPixels[i * 2]) & 0xff
+    return bytes(result)
+
+
+# Sizes the 4bpp layouts are documented to work for
+TYPE1_WIDTHS = (32, 64, 96, 128, 256, 384, 512)
+TYPE1_HEIGHTS = (16, 32, 48, 64, 80, 96, 112, 128, 256, 384)
+TYPE2_WIDTHS = (16, 32, 48, 64, 128, 256, 512)
+TYPE2_HEIGHTS = (4, 8, 16, 32, 64, 128, 256)
+
+
+def benchmark(sizes=((256, 256), (512, 256), (128, 64)), repeat=3):
+    """
+    Times the table based unswizzle against the old per-texel loop, and checks
+    that both give identical output and that swizzle8 inverts unswizzle8.
+    """
+    rng = np.random.default_rng(0)
+    print("8bpp unswizzle:")
+    results = {}
+    for width, height in sizes:
+        data = rng.integers(0, 256, width * height, dtype=np.uint8).tobytes()
+
+        start = time.perf_counter()
+        expected = _legacy_unswizzle8(data, width, height)
+        legacy_time = time.perf_counter() - start
+
+        swizzle8_indices.cache_clear()
+        start = time.perf_counter()
+        output = unswizzle8(data, width, height)
+        first_time = time.perf_counter() - start
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = unswizzle8(data, width, height)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        if output != expected:
+            raise AssertionError(f"unswizzle8 output differs from the legacy loop at {width}x{height}")
+        if swizzle8(output, width, height) != data:
+            raise AssertionError(f"swizzle8 does not invert unswizzle8 at {width}x{height}")
+
+        results[(width, height)] = (legacy_time, first_time, best)
+        print(f"  {width}x{height}: legacy {legacy_time * 1000:9.2f} ms, first call {first_time * 1000:7.3f} ms, "
+              f"cached {best * 1000:7.3f} ms  ({legacy_time / best:8.1f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    # The property check lives with the other tests in test_functions
+    from test_functions import check_swizzles
+    benchmark()
+    raise SystemExit(0 if check_swizzles() else 1)
@@ -0,0 +1,28 @@
+import os
+
+# Raw payload dumps.
+# Writing every texture and palette out as a .bin file is only useful for
+# debugging the formats, so the extractors only do it when given a dump
+# directory.
+
+
+class RawDumpSink:
+    """
+    Writes the raw texture (and palette) data of each texture it is given to
+    dump_dir, as texture_<offset>.bin and palette_<offset>.bin.
+    """
+
+    def __init__(self, dump_dir):
+        self.dump_dir = dump_dir
+        os.makedirs(dump_dir, exist_ok=True)
+
+    def write(self, texture, texture_data=None):
+        if texture_data is None:
+            texture_data = texture.data
+        with open(os.path.join(self.dump_dir, f"texture_{texture.offset:x}.bin"), "wb") as texture_file:
+            texture_file.write(texture_data)
+
+        palette_data = texture.palette_data
+        if palette_data is not None and texture.palette_data_offset is not None:
+            with open(os.path.join(self.dump_dir, f"palette_{texture.palette_data_offset:x}.bin"), "wb") as palette_file:
+                palette_file.write(palette_data)
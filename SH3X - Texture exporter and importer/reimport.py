@@ -1,9 +1,15 @@
-import png
 import struct
 import sys
 import os
+import hashlib
+import json
+import mmap
 from PIL import Image
 from image_processing import convert_bgra_to_rgba, save_images
+from pixel_conversion import rgba_to_bgra, image_to_bgra
+from parallel_export import iter_jobs
+from texture_patch import PatchWriter
+from atomic_io import atomic_write_json
 
 
 
@@ -11,32 +17,164 @@ def convert_rgba_to_bgra(rgba_data):
     """
     Converts RGBA data to BGRA data by swapping the red and blue channels.
     """
-    bgra_data = bytearray(len(rgba_data))
-    for i in range(0, len(rgba_data), 4):
-        bgra_data[i] = rgba_data[i+2] # blue channel
-        bgra_data[i+1] = rgba_data[i+1] # green channel
-        bgra_data[i+2] = rgba_data[i] # red channel
-        bgra_data[i+3] = rgba_data[i+3] # alpha channel
-    return bytes(bgra_data)
-
-def import_textures(arc_filename, png_dir):
-    with open(arc_filename, "r+b") as f:
-        # Iterate over all PNG files in the png_dir
-        for png_file in os.listdir(png_dir):
-            if png_file.endswith(".png"):
-                # Extract the offset from the filename
-                offset_str = png_file.split("_")[1].split(".bin")[0]
-                texture_data_offset = int(offset_str, 16)
-
-                # Read the texture data from the PNG file
-                png_path = os.path.join(png_dir, png_file)
-                rgba_data = Image.open(png_path).convert("RGBA").tobytes()
-                bgra_data = convert_rgba_to_bgra(rgba_data)
-
-                # Write the new texture data to the file
-                f.seek(texture_data_offset)
-                f.write(bgra_data)
-                print(f"{png_file} data written at offset {texture_data_offset}")
+    return rgba_to_bgra(rgba_data)
+
+# Hash manifest kept in the PNG folder by incremental reimports
+MANIFEST_NAME = ".reimport_manifest.json"
+
+
+def texture_offset_from_filename(png_file):
+    """
+    Returns the archive offset encoded in an exported texture name (texture_<hex offset>.bin.png).
+    """
+    offset_str = png_file.split("_")[1].split(".bin")[0]
+    return int(offset_str, 16)
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def load_manifest(png_dir, arc_filename):
+    """
+    Returns the {png name: record} manifest of the last reimport of png_dir into arc_filename.
+    """
+    try:
+        with open(os.path.join(png_dir, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get(os.path.abspath(arc_filename), {})
+
+
+def save_manifest(png_dir, arc_filename, records):
+    path = os.path.join(png_dir, MANIFEST_NAME)
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest[os.path.abspath(arc_filename)] = records
+    atomic_write_json(path, manifest, indent=1)
+
+
+def _decode_png(png_path):
+    # Runs in a worker process: decode a PNG to BGRA and hash it
+    bgra_data = image_to_bgra(Image.open(png_path))
+    return bgra_data, hash_bytes(bgra_data)
 
 
-    print(f"All textures imported into {arc_filename}")
+def import_textures(arc_filename, png_dir, incremental=False, workers=None, progress=None, patch_path=None):
+    """
+    Writes every texture_<offset>.bin.png in png_dir back into the archive.
+
+    PNG decoding and BGRA conversion run in a process pool when workers > 1
+    (0 = one worker per core); a single writer applies the results to the
+    memory-mapped archive in ascending offset order. With incremental, textures
+    whose pixels already match the bytes in the archive are skipped, and a hash
+    manifest in png_dir lets unchanged PNGs be skipped without decoding them.
+
+    With patch_path the archive is left untouched and the changed textures are
+    written to a patch file instead (see texture_patch), for distributing mods.
+
+    progress(done, total, png_file, status, error) is called for every PNG with
+    status "written", "skipped" or "failed". Returns a summary dict.
+    """
+    previous = load_manifest(png_dir, arc_filename) if incremental else {}
+    records = {}
+    summary = {"written": 0, "skipped": 0, "failed": []}
+
+    # Collect the PNG files in png_dir, in ascending offset order
+    textures = []
+    unnamed = []
+    for png_file in os.listdir(png_dir):
+        if not png_file.endswith(".png"):
+            continue
+        try:
+            # Extract the offset from the filename
+            textures.append((texture_offset_from_filename(png_file), png_file))
+        except (IndexError, ValueError):
+            unnamed.append(png_file)
+    textures.sort()
+    total = len(textures) + len(unnamed)
+    done = 0
+
+    def report(png_file, status, error=None):
+        nonlocal done
+        done += 1
+        if status == "failed":
+            summary["failed"].append((png_file, error))
+            print(f"Failed to import {png_file}: {error}")
+        else:
+            summary[status] += 1
+        if progress is not None:
+            progress(done, total, png_file, status, error)
+
+    for png_file in unnamed:
+        report(png_file, "failed", "no texture offset in the file name")
+
+    patch = None
+    if patch_path is not None:
+        patch = PatchWriter(patch_path, source_filename=arc_filename)
+
+    with open(arc_filename, "rb" if patch else "r+b") as f:
+        archive = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if patch else mmap.ACCESS_WRITE)
+        try:
+            # PNGs that are unchanged since the last run are checked against the archive without decoding
+            to_decode = []
+            for texture_data_offset, png_file in textures:
+                stat = os.stat(os.path.join(png_dir, png_file))
+                record = previous.get(png_file)
+                if (record is not None and record["size"] == stat.st_size
+                        and record["mtime_ns"] == stat.st_mtime_ns and record["offset"] == texture_data_offset
+                        and hash_bytes(archive[texture_data_offset:texture_data_offset + record["length"]]) == record["hash"]):
+                    records[png_file] = record
+                    report(png_file, "skipped")
+                else:
+                    to_decode.append((texture_data_offset, png_file, stat))
+
+            png_paths = [os.path.join(png_dir, png_file) for _, png_file, _ in to_decode]
+            for (texture_data_offset, png_file, stat), (result, error) in zip(to_decode, iter_jobs(_decode_png, png_paths, workers)):
+                if error is not None:
+                    report(png_file, "failed", error.splitlines()[0])
+                    continue
+                bgra_data, bgra_hash = result
+                end = texture_data_offset + len(bgra_data)
+                if end > len(archive):
+                    report(png_file, "failed", f"texture ends at {end:#x}, past the end of the archive")
+                    continue
+
+                if incremental:
+                    records[png_file] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "offset": texture_data_offset,
+                        "length": len(bgra_data),
+                        "hash": bgra_hash,
+                    }
+                    if hash_bytes(archive[texture_data_offset:end]) == bgra_hash:
+                        report(png_file, "skipped")
+                        continue
+
+                # Write the new texture data to the file (or the patch)
+                if patch:
+                    patch.write(texture_data_offset, bgra_data)
+                else:
+                    archive[texture_data_offset:end] = bgra_data
+                print(f"{png_file} data written at offset {texture_data_offset}")
+                report(png_file, "written")
+            if not patch:
+                archive.flush()
+        finally:
+            archive.close()
+            if patch:
+                patch.close()
+
+    if incremental:
+        save_manifest(png_dir, arc_filename, records)
+        print(f"{summary['skipped']} unchanged textures skipped")
+    if patch:
+        print(f"Patch for {arc_filename} written to {patch_path}")
+    else:
+        print(f"All textures imported into {arc_filename}")
+    return summary
@@ -1,22 +1,11 @@
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
+from ps2_swizzle import swizzle8
 
 def swizzle_32_to_8(p_in_texels, width, height):
-    p_swiz_texels = bytearray(width * height)
-
-    for y in range(height):
-        for x in range(width):
-            block_location = (y & ~0xf) * width + (x & ~0xf) * 2
-            swap_selector = (((y + 2) >> 2) & 0x1) * 4
-            pos_y = (((y & ~3) >> 1) + (y & 1)) & 0x7
-            column_location = pos_y * width * 2 + ((x + swap_selector) & 0x7) * 4
-
-            byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)  # 0, 1, 2, 3
-
-            p_swiz_texels[block_location + column_location + byte_num] = p_in_texels[y * width + x]
-
-    return bytes(p_swiz_texels)
+    # One scatter through the cached permutation table (see ps2_swizzle)
+    return swizzle8(p_in_texels, width, height)
 
 def open_file():
     file_path = filedialog.askopenfilename()
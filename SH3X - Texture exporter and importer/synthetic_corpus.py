@@ -0,0 +1,168 @@
+import argparse
+import os
+import random
+
+from texture_header import (MASTER_HEADER_MAGIC, MASTER_HEADER_SIZE, PS2_TEXTURE_MAGIC, MasterHeader,
+                            PaletteHeader, TextureHeader, pack_master_header, pack_palette_header,
+                            pack_texture_header, palette_header_offset)
+
+# Synthetic SH3 texture archives.
+# Generates PC archives (groups of 32bpp BGRA textures behind master headers)
+# and PS2 files (swizzled 8bpp and 4bpp textures with palettes) in the layouts
+# the scanners expect, built with the texture_header pack functions. Used by
+# the benchmarks and self-checks so nothing depends on copyrighted game data.
+# Optionally decoys are planted in the payloads: signatures, and whole valid
+# textures, that a correct scanner must skip.
+
+PC_HEADER_SIZE = 96
+PC_FORMAT = b"\x20\x30\x00\x00"
+# PS2 header size by bpp
+PS2_HEADER_SIZES = {8: 80, 4: 112}
+PS2_ENTRY_SIZE = 64
+PS2_BYPP = 4
+PALETTE_BLOCK_SIZE = 256
+
+
+def random_bytes(rnd, size):
+    return rnd.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def pc_texture(rnd, offset, width, height):
+    """
+    Returns a PC texture header followed by random BGRA data, for a header at offset.
+    """
+    data_size = width * height * 4
+    header = TextureHeader(offset, PC_HEADER_SIZE, PC_HEADER_SIZE, width, height, 32, PC_FORMAT,
+                           data_size, data_size + PC_HEADER_SIZE)
+    return pack_texture_header(header) + random_bytes(rnd, data_size)
+
+
+def pc_archive(rnd, groups=4, textures_per_group=4, sizes=((64, 64), (128, 128), (256, 128)), decoys=False):
+    """
+    Returns a PC archive with groups of textures behind master headers.
+    """
+    out = bytearray(random_bytes(rnd, 37))
+    for _ in range(groups):
+        group = [rnd.choice(sizes) for _ in range(textures_per_group)]
+        master_offset = len(out)
+        out += pack_master_header(MasterHeader(master_offset, len(group), MASTER_HEADER_SIZE, 0))
+        for width, height in group:
+            texture = bytearray(pc_texture(rnd, len(out), width, height))
+            if decoys and width * height * 4 > 400 and rnd.random() < 0.5:
+                # A master header with a valid texture group inside the payload
+                decoy_offset = len(out) + PC_HEADER_SIZE + rnd.randrange(0, width * height * 4 - 400)
+                decoy = pack_master_header(MasterHeader(decoy_offset, 1, MASTER_HEADER_SIZE, 0))
+                decoy += pc_texture(rnd, decoy_offset + MASTER_HEADER_SIZE, 4, 4)
+                position = decoy_offset - len(out)
+                texture[position:position + len(decoy)] = decoy
+            out += texture
+        if decoys:
+            # A stray signature between the groups
+            out += MASTER_HEADER_MAGIC
+        out += random_bytes(rnd, rnd.randrange(0, 64))
+    return bytes(out)
+
+
+def ps2_palette_size(bpp):
+    colors = 1 << bpp
+    return colors * PS2_BYPP // PS2_ENTRY_SIZE * PALETTE_BLOCK_SIZE
+
+
+def ps2_texture(rnd, offset, width, height, bpp):
+    """
+    Returns a PS2 texture (header, swizzled texels, palette header and palette)
+    for a header at offset. The PS2 signature covers the low byte of the
+    width, so width must be a multiple of 256 for the scanner to find it.
+    """
+    header_size = PS2_HEADER_SIZES[bpp]
+    data_size = width * height * bpp // 8
+    palette_size = ps2_palette_size(bpp)
+    header = TextureHeader(offset, header_size, 0, width, height, bpp, bytes((bpp, 0x20, 0, 0)),
+                           data_size, header_size + data_size + palette_size)
+    out = bytearray(pack_texture_header(header))
+    out += random_bytes(rnd, data_size)
+    palette_offset = palette_header_offset(header)
+    palette_header = pack_palette_header(PaletteHeader(palette_offset, palette_size, PS2_BYPP, PS2_ENTRY_SIZE))
+    # 4bpp palette headers start inside the end of the texel data
+    position = palette_offset - offset
+    out[position:position + len(palette_header)] = palette_header
+    for _ in range(palette_size // PALETTE_BLOCK_SIZE):
+        out += random_bytes(rnd, PS2_ENTRY_SIZE) + bytes(PALETTE_BLOCK_SIZE - PS2_ENTRY_SIZE)
+    return bytes(out)
+
+
+def ps2_file(rnd, textures=8, sizes=((256, 64), (256, 128)), bpps=(8, 4), decoys=False):
+    """
+    Returns a PS2 file of palettized textures.
+    """
+    out = bytearray(random_bytes(rnd, 29))
+    for _ in range(textures):
+        width, height = rnd.choice(sizes)
+        texture = bytearray(ps2_texture(rnd, len(out), width, height, rnd.choice(bpps)))
+        if decoys and rnd.random() < 0.5:
+            # A complete texture hidden inside the texel data
+            decoy_offset = len(out) + PS2_HEADER_SIZES[4] + rnd.randrange(0, 256)
+            decoy = ps2_texture(rnd, decoy_offset, 256, 4, 8)
+            position = decoy_offset - len(out)
+            if position + len(decoy) <= len(texture):
+                texture[position:position + len(decoy)] = decoy
+        out += texture
+        if decoys:
+            # A stray signature that fails validation
+            out += PS2_TEXTURE_MAGIC
+        out += random_bytes(rnd, rnd.randrange(0, 48))
+    return bytes(out)
+
+
+def write_corpus(directory, pc_archives=2, groups=4, textures_per_group=8, pc_sizes=((128, 128), (256, 256)),
+                 ps2_files=2, ps2_textures=16, ps2_sizes=((256, 128), (256, 256)), decoys=False, seed=0):
+    """
+    Writes PC archives (corpus_<n>.arc) and PS2 files (corpus_<n>.ps2) to
+    directory and returns their paths as {"pc": [...], "ps2": [...]}.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    corpus = {"pc": [], "ps2": []}
+    for i in range(pc_archives):
+        path = os.path.join(directory, f"corpus_{i}.arc")
+        with open(path, "wb") as f:
+            f.write(pc_archive(rnd, groups, textures_per_group, pc_sizes, decoys))
+        corpus["pc"].append(path)
+    for i in range(ps2_files):
+        path = os.path.join(directory, f"corpus_{i}.ps2")
+        with open(path, "wb") as f:
+            f.write(ps2_file(rnd, ps2_textures, ps2_sizes, decoys=decoys))
+        corpus["ps2"].append(path)
+    return corpus
+
+
+def parse_sizes(text):
+    """
+    Parses "128x128,256x64" into ((128, 128), (256, 64)).
+    """
+    return tuple(tuple(int(value) for value in size.split("x")) for size in text.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic SH3 PC archives and PS2 texture files.")
+    parser.add_argument("directory", help="Directory to write the corpus to")
+    parser.add_argument("--pc-archives", type=int, default=2)
+    parser.add_argument("--groups", type=int, default=4, help="Master header groups per PC archive")
+    parser.add_argument("--textures-per-group", type=int, default=8)
+    parser.add_argument("--pc-sizes", type=parse_sizes, default="128x128,256x256")
+    parser.add_argument("--ps2-files", type=int, default=2)
+    parser.add_argument("--ps2-textures", type=int, default=16, help="Textures per PS2 file")
+    parser.add_argument("--ps2-sizes", type=parse_sizes, default="256x128,256x256",
+                        help="Widths must be multiples of 256")
+    parser.add_argument("--decoys", action="store_true", help="Plant signatures inside the payloads")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = write_corpus(args.directory, args.pc_archives, args.groups, args.textures_per_group, args.pc_sizes,
+                          args.ps2_files, args.ps2_textures, args.ps2_sizes, args.decoys, args.seed)
+    for kind, paths in corpus.items():
+        for path in paths:
+            print(f"{kind}: {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
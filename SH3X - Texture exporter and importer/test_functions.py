@@ -1,49 +1,45 @@
-def unswizzle_data(data, width, height):
-    unswizzled_data = bytearray(len(data))
-
-    for y in range(height):
-        for x in range(width):
-            block_location = (y & (~0xf)) * width + (x & (~0xf)) * 2
-            swap_selector = (((y + 2) >> 2) & 0x1) * 4
-            posY = (((y & (~3)) >> 1) + (y & 1)) & 0x7
-            column_location = posY * width * 2 + ((x + swap_selector) & 0x7) * 4
-
-            byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)  # 0,1,2,3
+import os
+import random
+import tempfile
+import numpy as np
+from PIL import Image
+import synthetic_corpus
+from archive_reader import ArchiveReader
+from parallel_scan import SCANNERS, SEGMENT_OVERLAP, parallel_scan
+from ps2_swizzle import (TYPE1, TYPE1_HEIGHTS, TYPE1_WIDTHS, TYPE2, TYPE2_HEIGHTS, TYPE2_WIDTHS,
+                         _legacy_unswizzle4_type1, _legacy_unswizzle4_type2, _legacy_unswizzle8,
+                         swizzle4, swizzle4_indices, swizzle8, swizzle8_indices, unpack4,
+                         unswizzle4, unswizzle4_to_8, unswizzle8)
 
-            index = block_location + column_location + byte_num
+def unswizzle_data(data, width, height):
+    texels = np.frombuffer(data, dtype=np.uint8)
+    unswizzled_data = np.zeros(len(data), dtype=np.uint8)
+    indices = swizzle8_indices(width, height)
 
-            if 0 <= index < len(data):  # Add this check
-                unswizzled_data[(y * width) + x] = data[index]
-            else:
-                print(f"Invalid index: {index}, data length: {len(data)}")
+    # Texels whose swizzled offset lies past the data are left at 0
+    valid = indices < len(data)
+    if not valid.all():
+        print(f"{np.count_nonzero(~valid)} invalid indices, data length: {len(data)}")
+    unswizzled_data[np.flatnonzero(valid)] = texels[indices[valid]]
 
-    return bytes(unswizzled_data)
+    return unswizzled_data.tobytes()
 
 def apply_palette(data, width, height, palette_data, num_palettes):
     if len(palette_data) % (4 * num_palettes) != 0:
         raise ValueError("Invalid palette data length")
 
-    # Convert palette data from bytes to tuples of RGBA values
-    palettes = [
-        [
-            (palette_data[i * 4 + j * 4 * num_palettes], palette_data[i * 4 + j * 4 * num_palettes + 1],
-             palette_data[i * 4 + j * 4 * num_palettes + 2], palette_data[i * 4 + j * 4 * num_palettes + 3])
-            for i in range(num_palettes)
-        ]
-        for j in range(len(palette_data) // (4 * num_palettes))
-    ]
-
-    # Apply the palette to the texture data
-    rgba_data = bytearray(width * height * 4)
-    for y in range(height):
-        for x in range(width):
-            index = data[y * width + x]
-            palette_index = (x // num_palettes) % len(palettes)
-            color = palettes[palette_index][index % num_palettes]
-            offset = (y * width + x) * 4
-            rgba_data[offset:offset + 4] = color
-
-    return bytes(rgba_data)
+    # The palette data holds consecutive palettes of num_palettes RGBA colors
+    colors = np.frombuffer(palette_data, dtype=np.uint8).reshape(-1, 4)
+    count = len(colors) // num_palettes
+
+    # Every run of num_palettes columns uses the next palette, so each pixel's
+    # color is found with one gather
+    x = np.arange(width)
+    palette_start = ((x // num_palettes) % count) * num_palettes
+    indices = np.frombuffer(data, dtype=np.uint8, count=width * height).reshape(height, width).astype(np.intp)
+    rgba_data = colors[palette_start + indices % num_palettes]
+
+    return rgba_data.tobytes()
 
 def unswizzle_and_save(textures, output_dir):
     for texture in textures:
@@ -68,5 +64,87 @@ def unswizzle_and_save(textures, output_dir):
     print(f"All textures unswizzled, palette applied, and saved to: {output_dir}")
 
 
-
-
+def check_parallel_scan(workers=2, seed=0):
+    """
+    Scans synthetic PC and PS2 archives serially and in parallel with segment
+    sizes down to a few bytes, and checks that the results are identical.
+    """
+    rnd = random.Random(seed)
+    archives = {
+        "pc": synthetic_corpus.pc_archive(rnd, groups=12, textures_per_group=3, sizes=((8, 8), (16, 16), (32, 16)),
+                                          decoys=True),
+        "ps2": synthetic_corpus.ps2_file(rnd, textures=16, sizes=((256, 16), (256, 32), (256, 64)), decoys=True),
+    }
+    ok = True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for kind, data in archives.items():
+            filename = os.path.join(temp_dir, f"synthetic_{kind}.bin")
+            with open(filename, "wb") as f:
+                f.write(data)
+            with ArchiveReader(filename) as reader:
+                expected = SCANNERS[kind][2](reader)
+            for segment_size in (7, 64, SEGMENT_OVERLAP, 1000, 4099, len(data) // 3, len(data)):
+                result = parallel_scan(filename, kind, workers, segment_size)
+                match = result == expected
+                ok = ok and match
+                print(f"{kind}: {len(expected)} textures, segment size {segment_size}: "
+                      f"{'identical' if match else 'MISMATCH'}")
+    return ok
+
+def test_parallel_scan():
+    assert check_parallel_scan()
+
+def check_swizzles(cases=40, seed=0):
+    """
+    Property check of the swizzles on random data at random supported sizes:
+    every unswizzle must match the old per-texel loop, swizzle must invert
+    unswizzle bit for bit in both directions, and every table must be a
+    permutation. Returns True when all cases pass.
+    """
+    rng = np.random.default_rng(seed)
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    for case in range(cases):
+        for name, widths, heights in (("8bpp", TYPE2_WIDTHS, TYPE2_HEIGHTS),
+                                      ("4bpp type 1", TYPE1_WIDTHS, TYPE1_HEIGHTS),
+                                      ("4bpp type 2", TYPE2_WIDTHS, TYPE2_HEIGHTS)):
+            width = int(rng.choice(widths))
+            height = int(rng.choice(heights))
+            label = f"{name} {width}x{height}"
+            if name == "8bpp":
+                data = rng.integers(0, 256, width * height, dtype=np.uint8).tobytes()
+                indices = swizzle8_indices(width, height)
+                linear = unswizzle8(data, width, height)
+                if case < 4:
+                    check(linear == _legacy_unswizzle8(data, width, height), f"{label}: differs from the old loop")
+                check(swizzle8(linear, width, height) == data, f"{label}: swizzle(unswizzle(x)) != x")
+                check(unswizzle8(swizzle8(data, width, height), width, height) == data,
+                      f"{label}: unswizzle(swizzle(x)) != x")
+            else:
+                layout = TYPE1 if name.endswith("1") else TYPE2
+                legacy = _legacy_unswizzle4_type1 if layout == TYPE1 else _legacy_unswizzle4_type2
+                data = rng.integers(0, 256, width * height // 2, dtype=np.uint8).tobytes()
+                indices = swizzle4_indices(width, height, layout)
+                linear = unswizzle4(data, width, height, layout)
+                if case < 4:
+                    check(linear == legacy(data, width, height), f"{label}: differs from the old loop")
+                check(swizzle4(linear, width, height, layout) == data, f"{label}: swizzle(unswizzle(x)) != x")
+                check(unswizzle4(swizzle4(data, width, height, layout), width, height, layout) == data,
+                      f"{label}: unswizzle(swizzle(x)) != x")
+                expanded = unswizzle4_to_8(data, width, height, layout)
+                check(expanded == unpack4(linear).tobytes(), f"{label}: expanded output differs")
+                check(swizzle4(expanded, width, height, layout, packed=False) == data,
+                      f"{label}: swizzle of expanded texels != x")
+            check(np.array_equal(np.sort(indices), np.arange(width * height)), f"{label}: table is not a permutation")
+
+    for message in failures:
+        print(f"FAIL {message}")
+    print(f"Swizzle self-check: {cases * 3} cases, {len(failures)} failures")
+    return not failures
+
+def test_swizzles():
+    assert check_swizzles()
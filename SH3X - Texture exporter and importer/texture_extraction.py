@@ -3,97 +3,125 @@ import sys
 import os
 from PIL import Image
 from image_processing import convert_bgra_to_rgba, save_images
+from pixel_conversion import bgra_to_image
+from archive_reader import ArchiveReader
+from texture_index import iter_or_scan
+from texture_record import Texture
+from texture_header import (MASTER_HEADER_MAGIC, MASTER_HEADER_SIZE, parse_master_header,
+                            read_texture_header, texture_data_offset)
+from parallel_export import iter_jobs, report_failures
+from atomic_io import atomic_save_image
+from raw_dump import RawDumpSink
+import profiling
 
-def extract_textures(filename):
+def parse_candidate(buf, size, offset):
+    """
+    Parses the group of textures at a master header match. Returns (entries,
+    next_offset): the entries of the group's valid textures (the group stops
+    at the first header that fails validation) and the offset after the last
+    of them, or offset + 1 if there are none.
+    """
+    if offset + MASTER_HEADER_SIZE > size:
+        return [], offset + 1
+    # Parse the values from the master header
+    master_header = parse_master_header(buf, offset)
+
+    entries = []
+    next_offset = offset + 1
+    # The first texture header follows the master header
+    header_offset = offset + MASTER_HEADER_SIZE
+    # Iterate over all textures in the section
+    for i in range(master_header.num_textures):
+        header = read_texture_header(buf, header_offset, size)
+        if header is None:
+            break
+
+        # The texture data follows the header
+        data_offset = texture_data_offset(header)
+        entries.append({
+            "index": i,
+            "header_offset": header_offset,
+            "header_size": header.header_size,
+            "width": header.width,
+            "height": header.height,
+            "bpp": header.bpp,
+            "offset": data_offset,
+            "data_size": header.data_size,
+            "total_size": header.total_size,
+        })
+        # The next texture header starts right after the texture data
+        header_offset = data_offset + header.data_size
+        next_offset = header_offset
+    return entries, next_offset
+
+
+def iter_entries(reader):
+    """
+    Scans a PC archive for texture headers and yields the entries of each
+    group of textures as soon as it is parsed. No texture data is read.
+    Texture headers are validated, and the search for the next master header
+    resumes after the last texture of a group, so the archive is searched
+    only once.
+    """
+    buf = reader.buffer
+    size = reader.size
+    # Search for the master header pattern
+    master_header_offset = reader.find(MASTER_HEADER_MAGIC)
+    while master_header_offset != -1:
+        entries, next_offset = parse_candidate(buf, size, master_header_offset)
+        yield from entries
+        # Find the next master header
+        master_header_offset = reader.find(MASTER_HEADER_MAGIC, next_offset)
+
+
+def scan_textures(reader):
+    """
+    Returns the entries of every texture in a PC archive.
+    """
+    return list(iter_entries(reader))
+
+
+def iter_file_entries(filename, use_index=True):
+    """
+    Yields the PC texture entries of an archive while the scan advances, using
+    the cached index when it is still valid.
+    """
+    with ArchiveReader(filename) as reader:
+        yield from iter_or_scan(filename, "pc", lambda: iter_entries(reader), use_index)
+
+
+def iter_textures(filename, use_mmap=True, use_index=True):
+    """
+    Yields a Texture descriptor for every texture in a PC archive while the scan
+    advances. Payloads are only read from the archive when a consumer accesses
+    texture.data. With use_index the scan results are cached (see texture_index)
+    so repeat runs seek straight to the textures. The archive is closed when
+    the generator finishes or is closed; textures used after that open it again.
+    """
+    reader = ArchiveReader(filename, use_mmap=use_mmap)
+    try:
+        for entry in iter_or_scan(filename, "pc", lambda: iter_entries(reader), use_index):
+            yield Texture(entry, f"texture_{entry['offset']:x}.bin", reader)
+    finally:
+        reader.close()
+
+
+def extract_textures(filename, use_mmap=True, use_index=True, dump_dir=None):
+    """
+    Extracts the textures of a PC archive into a list. By default each texture's
+    data stays a zero-copy view into the memory-mapped archive, like
+    iter_textures; callers that need the textures to own their bytes (so the
+    archive can be released or patched) pass use_mmap=False to have them copied
+    out. With dump_dir the raw texture data is also written there as
+    texture_<offset>.bin files.
+    """
+    dump = RawDumpSink(dump_dir) if dump_dir is not None else None
     textures = []
-    with open(filename, "rb") as f:
-        # Search for the master header pattern
-        master_header_pattern = b"\xFF\xFF\xFF\xFF\x00\x00\x00\x00\x20\x00\x00\x00"
-        data = f.read()
-        master_header_offset = data.find(master_header_pattern)
-        while master_header_offset != -1:
-            # Seek to the master header
-            f.seek(master_header_offset)
-            # Read the master header
-            master_header = f.read(0x20)
-            # Parse the values from the master header
-            num_textures = master_header[20]
-            texture_offset = struct.unpack("<I", master_header[8:12])[0]
-            texture_size = struct.unpack(">I", master_header[12:16])[0]
-            # print the parsed values
-            print("Number of textures:", num_textures)
-            print("Texture offset:", hex(texture_offset))
-            print("Texture size:", hex(texture_size))
-
-            # Iterate over all textures in the section
-            for i in range(num_textures):
-                # Read the texture header
-                texture_header = f.read(0x20)
-                # Check the pattern to determine the header size
-                if texture_header[12:16] == b"\x20\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x08\x30\x00\x00":
-                    header_size = 96
-                elif texture_header[12:16] == b"\x18\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x20\x50\x00\x00":
-                    header_size = 128
-                elif texture_header[12:16] == b"\x08\x20\x00\x00":
-                    header_size = 80
-                else:
-                    header_size = 80
-                # Calculate the offset of the texture header
-                header_offset = f.tell() - 0x20
-                # Read the remaining bytes of the texture header
-                texture_header += f.read(header_size - 0x20)
-                
-                # print the texture header values and offset
-                print(f"Texture header for texture {i}: {texture_header}")
-                print(f"  Width: {struct.unpack('<H', texture_header[8:10])[0]}")
-                print(f"  Height: {struct.unpack('<H', texture_header[10:12])[0]}")
-                print(f"  bpp: {struct.unpack('<B', texture_header[12:13])[0]}")
-                print(f"  Data size: {struct.unpack('<I', texture_header[16:20])[0]}")
-                print(f"  Total size: {struct.unpack('<I', texture_header[20:24])[0]}")
-
-                # Parse the values from the texture header
-                width = struct.unpack("<H", texture_header[8:10])[0]
-                height = struct.unpack("<H", texture_header[10:12])[0]
-                bpp = struct.unpack("<B", texture_header[12:13])[0]
-                data_size = struct.unpack("<I", texture_header[16:20])[0]
-                total_size = struct.unpack("<I", texture_header[20:24])[0]
-                data_offset = struct.unpack("<I", texture_header[4:8])[0]
-
-                # Read the texture data
-                texture_data_offset = f.tell()
-                f.seek(texture_data_offset)
-                texture_data = f.read(data_size)
-                # Create the output directory if it doesn't exist
-                if not os.path.exists("output"):
-                    os.mkdir("output")
-                # Write the texture data to a separate file
-                with open(f"output/texture_{texture_data_offset:x}.bin", "wb") as texture_file:
-                    texture_file.write(texture_data)
-                # Move the file pointer to the start of the next texture header
-                f.seek(texture_data_offset + data_size)
-                # Add the texture information to the list of textures
-                texture = {
-                    "index": i,
-                    "width": width,
-                    "height": height,
-                    "bpp": bpp,
-                    "data_size": data_size,
-                    "data": texture_data,
-                    "offset": texture_data_offset,
-                    "total_size": total_size,
-                    "filename": f"texture_{texture_data_offset:x}.bin"
-                }
-                textures.append(texture)
-            # Find the next master header
-            master_header_offset = data.find(master_header_pattern, master_header_offset + 1)
-            if master_header_offset == -1:
-                break
+    for texture in iter_textures(filename, use_mmap, use_index):
+        texture_data = texture.data if use_mmap else texture.load()
+        if dump is not None:
+            dump.write(texture, texture_data)
+        textures.append(texture)
 
     return textures
     
@@ -102,28 +130,46 @@ def convert_texture_to_image(texture):
     width = texture["width"]
     height = texture["height"]
 
-    # Convert BGRA data to RGBA
-    rgba_data = convert_bgra_to_rgba(texture_data)
-
-    # Convert RGBA data to a Pillow Image object
-    img = Image.frombytes("RGBA", (width, height), rgba_data)
+    # Decode the BGRA data straight into an RGBA Pillow Image object
+    img = bgra_to_image(texture_data, width, height)
     return img
 
+def png_path(filename, output_dir):
+    return os.path.join(output_dir, f"{filename}.png")
+
+
 def save_image_to_disk(img, filename, output_dir):
-    img_path = os.path.join(output_dir, f"{filename}.png")
-    img.save(img_path)
+    atomic_save_image(img, png_path(filename, output_dir))
 
 
-def convert_textures_to_png(textures, output_dir):
-    # Iterate over all extracted textures
-    for i, texture in enumerate(textures):
-        filename = texture["filename"]
-        
-        # Convert texture to a Pillow Image object
-        img = convert_texture_to_image(texture)
-        
-        # Save the Pillow Image object to disk
-        save_image_to_disk(img, filename, output_dir)
+def _export_png(job):
+    # Runs in a worker process: decode one texture and save it as PNG
+    filename, width, height, texture_data, output_dir = job
+    with profiling.stage("convert", pixels_converted=width * height):
+        img = bgra_to_image(texture_data, width, height)
+    save_image_to_disk(img, filename, output_dir)
+    return filename
 
-    print(f"All textures converted to PNG and saved to: {output_dir}")
 
+def convert_textures_to_png(textures, output_dir, workers=None, progress=None):
+    """
+    Converts textures to PNG files in output_dir. workers > 1 spreads the PNG
+    encoding over a process pool (0 = one worker per core). progress(texture, error)
+    is called as each texture completes. Returns the (filename, error) pairs of
+    textures that failed to export.
+    """
+    # The textures are walked more than once (jobs, progress, failures), so a generator is read into a list
+    textures = list(textures)
+    jobs = (
+        (texture["filename"], texture["width"], texture["height"], bytes(texture["data"]), output_dir)
+        for texture in textures
+    )
+    results = []
+    for texture, result in zip(textures, iter_jobs(_export_png, jobs, workers)):
+        results.append(result)
+        if progress is not None:
+            progress(texture, result[1])
+    failures = report_failures([texture["filename"] for texture in textures], results)
+
+    print(f"All textures converted to PNG and saved to: {output_dir}")
+    return failures
@@ -0,0 +1,163 @@
+import struct
+from collections import namedtuple
+
+# Texture header codec shared by the PC and PS2 scanners.
+# Header layouts are precompiled struct.Struct objects that decode straight
+# from the archive buffer (bytes, mmap or memoryview) with unpack_from, and
+# the header size is looked up in a table keyed by the 4 format bytes at
+# offset 12. New header variants only need a new row in HEADER_SIZES.
+
+# Master header in front of each group of PC textures
+MASTER_HEADER_MAGIC = b"\xFF\xFF\xFF\xFF\x00\x00\x00\x00\x20\x00\x00\x00"
+MASTER_HEADER_SIZE = 0x20
+# Start of every PS2 texture header
+PS2_TEXTURE_MAGIC = b"\xFF\xFF\xFF\xFF\x00\x00\x00\x00\x00"
+
+TEXTURE_MAGIC = b"\xFF\xFF\xFF\xFF"
+DEFAULT_HEADER_SIZE = 80
+
+# Header size by format bytes (bpp, layout, 0, 0)
+HEADER_SIZES = {
+    b"\x20\x30\x00\x00": 96,
+    b"\x18\x30\x00\x00": 96,
+    b"\x08\x30\x00\x00": 96,
+    b"\x18\x50\x00\x00": 128,
+    b"\x20\x50\x00\x00": 128,
+    b"\x08\x20\x00\x00": 80,
+    b"\x04\x20\x00\x00": 112,
+}
+MAX_HEADER_SIZE = max(HEADER_SIZES.values())
+
+# The palette header of 4bpp textures (112 byte headers) starts 0x20 bytes before the end of the data
+PALETTE_HEADER_BACKSTEP = {112: 0x20}
+PALETTE_HEADER_SIZE = 0x30
+
+# Plausibility limits used to reject signature matches inside pixel data
+MAX_TEXTURE_DIMENSION = 4096
+VALID_BPP = (4, 8, 16, 24, 32)
+
+# magic, data offset, width, height, format (bpp + layout bytes), data size, total size
+_TEXTURE_HEADER = struct.Struct("<4sIHH4sII")
+# the same fields without the magic, for writing headers back
+_TEXTURE_HEADER_FIELDS = struct.Struct("<IHH4sII")
+# magic (8 bytes), texture offset (LE)
+_MASTER_HEADER = struct.Struct("<8sI")
+# texture size is stored big endian after the texture offset, the texture count at byte 20
+_MASTER_HEADER_SIZE_FIELD = struct.Struct(">12xI4xB")
+# palette data size, bytes per color, entry size
+_PALETTE_HEADER = struct.Struct("<I8xBxB")
+
+TextureHeader = namedtuple(
+    "TextureHeader",
+    "header_offset header_size data_offset width height bpp format data_size total_size",
+)
+MasterHeader = namedtuple("MasterHeader", "offset num_textures texture_offset texture_size")
+PaletteHeader = namedtuple("PaletteHeader", "offset data_size bypp entry_size")
+
+
+def header_size_for(format_bytes):
+    return HEADER_SIZES.get(bytes(format_bytes), DEFAULT_HEADER_SIZE)
+
+
+def parse_texture_header(buf, offset):
+    """
+    Decodes the texture header at offset and looks up its size from the format bytes.
+    """
+    magic, data_offset, width, height, format_bytes, data_size, total_size = _TEXTURE_HEADER.unpack_from(buf, offset)
+    return TextureHeader(offset, header_size_for(format_bytes), data_offset, width, height,
+                         format_bytes[0], format_bytes, data_size, total_size)
+
+
+def is_valid_texture_header(header, size):
+    """
+    Checks a parsed texture header against plausible bounds for an archive of size bytes.
+    """
+    return (0 < header.width <= MAX_TEXTURE_DIMENSION
+            and 0 < header.height <= MAX_TEXTURE_DIMENSION
+            and header.bpp in VALID_BPP
+            and header.format[2:] == b"\x00\x00"
+            and header.data_size >= header.width * header.height * header.bpp // 8
+            and texture_data_offset(header) + header.data_size <= size)
+
+
+def read_texture_header(buf, offset, size):
+    """
+    Parses the texture header at offset, or returns None if it doesn't fit in
+    the archive or fails validation.
+    """
+    if offset < 0 or offset + _TEXTURE_HEADER.size > size:
+        return None
+    header = parse_texture_header(buf, offset)
+    return header if is_valid_texture_header(header, size) else None
+
+
+def texture_data_offset(header):
+    """
+    Returns the archive offset of the texture data, which follows the header.
+    """
+    return header.header_offset + header.header_size
+
+
+def palette_header_offset(header):
+    """
+    Returns the archive offset of a PS2 texture's palette header.
+    """
+    return (texture_data_offset(header) + header.data_size
+            - PALETTE_HEADER_BACKSTEP.get(header.header_size, 0))
+
+
+def pack_texture_header(header, buf=None):
+    """
+    Serializes a texture header. The magic and any bytes the codec doesn't know
+    about are taken from buf (the original header) or start out as
+    FF FF FF FF followed by zeroes.
+    """
+    if buf is None:
+        out = bytearray(header.header_size)
+        out[0:4] = TEXTURE_MAGIC
+    else:
+        out = bytearray(buf[:header.header_size])
+    _TEXTURE_HEADER_FIELDS.pack_into(out, 4, header.data_offset, header.width, header.height,
+                                     bytes(header.format), header.data_size, header.total_size)
+    return bytes(out)
+
+
+def parse_master_header(buf, offset):
+    magic, texture_offset = _MASTER_HEADER.unpack_from(buf, offset)
+    texture_size, num_textures = _MASTER_HEADER_SIZE_FIELD.unpack_from(buf, offset)
+    return MasterHeader(offset, num_textures, texture_offset, texture_size)
+
+
+def pack_master_header(header):
+    out = bytearray(MASTER_HEADER_SIZE)
+    # The size field struct zero-fills the bytes in front of it, so it is written first
+    _MASTER_HEADER_SIZE_FIELD.pack_into(out, 0, header.texture_size, header.num_textures)
+    _MASTER_HEADER.pack_into(out, 0, MASTER_HEADER_MAGIC[:8], header.texture_offset)
+    return bytes(out)
+
+
+def parse_palette_header(buf, offset):
+    data_size, bypp, entry_size = _PALETTE_HEADER.unpack_from(buf, offset)
+    return PaletteHeader(offset, data_size, bypp, entry_size)
+
+
+def read_palette_header(buf, offset, size):
+    """
+    Parses the palette header at offset, or returns None if it or its palette
+    data doesn't fit in the archive or fails validation.
+    """
+    if offset < 0 or offset + PALETTE_HEADER_SIZE > size:
+        return None
+    header = parse_palette_header(buf, offset)
+    if header.data_size == 0 or header.bypp == 0 or header.entry_size == 0:
+        return None
+    if offset + PALETTE_HEADER_SIZE + header.data_size > size:
+        return None
+    return header
+
+
+def pack_palette_header(header):
+    # Only the known fields are written, the rest of the header is zeroed
+    out = bytearray(PALETTE_HEADER_SIZE)
+    _PALETTE_HEADER.pack_into(out, 0, header.data_size, header.bypp, header.entry_size)
+    return bytes(out)
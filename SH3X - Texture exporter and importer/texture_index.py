@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+
+import profiling
+from atomic_io import atomic_write_json
+
+# Persistent texture index.
+# Scanning an archive for texture headers is the slow part of opening it, so
+# the scan results (offsets, sizes, dimensions and palette locations) are kept
+# in a small JSON file in a cache directory. An index is only used while the
+# archive's path, size, mtime and content hash all still match, so any change
+# to the archive invalidates it automatically.
+
+# Bump this whenever the scanners or the entry layout change
+INDEX_VERSION = 3
+
+# Sampled content hash: the head and tail of the file plus evenly spaced windows
+HASH_EDGE_SIZE = 1024 * 1024
+HASH_WINDOW_SIZE = 64 * 1024
+HASH_WINDOWS = 16
+
+
+def get_cache_root():
+    """
+    Returns the directory SH3X keeps its caches in (SH3X_CACHE_DIR overrides the default).
+    """
+    cache_dir = os.environ.get("SH3X_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".sh3x_cache")
+    return cache_dir
+
+
+def get_cache_dir():
+    """
+    Returns the directory the index files are kept in.
+    """
+    return os.path.join(get_cache_root(), "index")
+
+
+def content_hash(filename):
+    """
+    Hashes the size, head, tail and evenly spaced windows of a file. This reads
+    a few MB at most, so it stays cheap even for multi-GB archives.
+    """
+    size = os.path.getsize(filename)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filename, "rb") as f:
+        if size <= 2 * HASH_EDGE_SIZE + HASH_WINDOWS * HASH_WINDOW_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(HASH_EDGE_SIZE))
+            step = (size - 2 * HASH_EDGE_SIZE) // (HASH_WINDOWS + 1)
+            for i in range(1, HASH_WINDOWS + 1):
+                f.seek(HASH_EDGE_SIZE + i * step)
+                digest.update(f.read(HASH_WINDOW_SIZE))
+            f.seek(size - HASH_EDGE_SIZE)
+            digest.update(f.read(HASH_EDGE_SIZE))
+    return digest.hexdigest()
+
+
+def archive_key(filename):
+    """
+    Returns the values an index is keyed by: absolute path, size, mtime and content hash.
+    """
+    stat = os.stat(filename)
+    return {
+        "path": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash(filename),
+    }
+
+
+def index_path(filename, kind):
+    name = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_dir(), f"{name}_{kind}.json")
+
+
+def load_index(filename, kind):
+    """
+    Returns the cached scan entries for an archive, or None if there is no
+    index or the archive changed since it was written.
+    """
+    path = index_path(filename, kind)
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != INDEX_VERSION or index.get("kind") != kind:
+        return None
+    if index.get("archive") != archive_key(filename):
+        return None
+    return index["entries"]
+
+
+def save_index(filename, kind, entries):
+    """
+    Writes the scan entries for an archive. Failing to write the cache is not fatal.
+    """
+    path = index_path(filename, kind)
+    index = {
+        "version": INDEX_VERSION,
+        "kind": kind,
+        "archive": archive_key(filename),
+        "entries": entries,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_json(path, index)
+    except OSError as e:
+        print(f"Could not write texture index for {filename}: {e}")
+
+
+def iter_or_scan(filename, kind, scan, use_index=True):
+    """
+    Yields the scan entries for an archive. With a valid index they come from
+    the cache, otherwise they are yielded as scan() finds them and cached once
+    the scan runs to completion.
+    """
+    if use_index:
+        with profiling.stage("index_load"):
+            entries = load_index(filename, kind)
+        if entries is not None:
+            profiling.count("index_load", textures_parsed=len(entries))
+            yield from entries
+            return
+
+    entries = []
+    for entry in profiling.timed_iter("scan", scan()):
+        entries.append(entry)
+        yield entry
+    profiling.count("scan", bytes_scanned=os.path.getsize(filename), textures_parsed=len(entries))
+    if use_index:
+        save_index(filename, kind, entries)
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+
+import parallel_scan
+import ps2_mode
+import texture_extraction
+from atomic_io import atomic_write_json
+from texture_index import archive_key
+
+# Scan-only texture manifests.
+# A manifest lists the metadata of every texture in one or more archives
+# (offsets, dimensions, bpp, sizes and palette locations) as JSON. Building
+# one only scans the texture headers, no texture or palette data is read.
+
+MANIFEST_VERSION = 1
+
+SCANNERS = {
+    "pc": texture_extraction.iter_file_entries,
+    "ps2": ps2_mode.iter_file_entries,
+}
+
+
+def archive_manifest(filename, kind, use_index=True, scan_workers=None):
+    """
+    Scans an archive ("pc" or "ps2") and returns its manifest entry. With
+    scan_workers the archive is scanned in parallel segments (see parallel_scan).
+    """
+    if scan_workers is not None:
+        entries = parallel_scan.iter_file_entries(filename, kind, use_index, scan_workers)
+    else:
+        entries = SCANNERS[kind](filename, use_index)
+    return {
+        "archive": archive_key(filename),
+        "kind": kind,
+        "textures": list(entries),
+    }
+
+
+def build_manifest(filenames, kind, use_index=True, scan_workers=None):
+    return {
+        "version": MANIFEST_VERSION,
+        "archives": [archive_manifest(filename, kind, use_index, scan_workers) for filename in filenames],
+    }
+
+
+def write_manifest(path, manifest):
+    """
+    Writes a manifest as JSON, replacing any existing file only once it is complete.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    atomic_write_json(path, manifest, indent=1)
+    return path
+
+
+def load_manifest(path):
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version {manifest.get('version')}")
+    return manifest
+
+
+def scan_to_manifest(filenames, kind, path, use_index=True, scan_workers=None):
+    """
+    Writes the manifest of the archives to path and returns the number of textures found.
+    """
+    manifest = build_manifest(filenames, kind, use_index, scan_workers)
+    write_manifest(path, manifest)
+    count = sum(len(archive["textures"]) for archive in manifest["archives"])
+    print(f"{count} textures from {len(filenames)} archives written to {path}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a JSON manifest of the textures in SH3 archives without extracting them.")
+    parser.add_argument("archives", nargs="+", help="Archives to scan")
+    parser.add_argument("-o", "--output", default="manifest.json", help="Manifest file to write")
+    parser.add_argument("--ps2", action="store_true", help="Scan for PS2 textures instead of PC textures")
+    parser.add_argument("--no-index", action="store_true", help="Ignore the cached texture index and rescan")
+    parser.add_argument("--scan-workers", type=int, help="Scan each archive in parallel segments (0 = one worker per core)")
+    args = parser.parse_args()
+    scan_to_manifest(args.archives, "ps2" if args.ps2 else "pc", args.output, use_index=not args.no_index,
+                     scan_workers=args.scan_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import os
+import struct
+
+from texture_index import content_hash
+
+# Binary patch files for archives.
+# Instead of shipping whole modified archives, a mod can be distributed as a
+# patch: a list of operations that turn a pristine archive into the modified
+# one. Patches are streamed onto the archive with positional writes, so
+# neither the patch nor the archive is ever loaded into memory in full.
+#
+# Layout (little endian):
+#   header: magic "SH3PATCH", version (u16), source size (u64), target size (u64),
+#           source content hash (16 bytes, zero if unknown), operation count (u32)
+#   operations: type (u8), offset (u64), source offset (u64), length (u64)
+#     WRITE: followed by length bytes that are written at offset
+#     MOVE:  copies length bytes of the archive from source offset to offset
+
+PATCH_MAGIC = b"SH3PATCH"
+PATCH_VERSION = 1
+
+OP_WRITE = 1
+OP_MOVE = 2
+
+_PATCH_HEADER = struct.Struct("<8sHQQ16sI")
+_PATCH_OP = struct.Struct("<BQQQ")
+
+# Chunk size for streaming data between the patch and the archive
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class PatchError(Exception):
+    pass
+
+
+class PatchWriter:
+    """
+    Writes a patch file. Operations are stored in the order they are added
+    and applied in that order.
+    """
+
+    def __init__(self, path, source_filename=None, target_size=None):
+        self.path = path
+        self.count = 0
+        source_size = 0
+        source_hash = bytes(16)
+        if source_filename is not None:
+            source_size = os.path.getsize(source_filename)
+            source_hash = bytes.fromhex(content_hash(source_filename))
+        if target_size is None:
+            target_size = source_size
+        self._header = [PATCH_MAGIC, PATCH_VERSION, source_size, target_size, source_hash]
+        self._file = open(path, "wb")
+        self._file.write(_PATCH_HEADER.pack(*self._header, 0))
+
+    def write(self, offset, data):
+        """
+        Adds an operation writing data at offset.
+        """
+        self._file.write(_PATCH_OP.pack(OP_WRITE, offset, 0, len(data)))
+        self._file.write(data)
+        self.count += 1
+
+    def move(self, source_offset, offset, length):
+        """
+        Adds an operation copying length bytes of the archive from source_offset to offset.
+        """
+        self._file.write(_PATCH_OP.pack(OP_MOVE, offset, source_offset, length))
+        self.count += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        # Fill in the operation count now that it is known
+        self._file.seek(0)
+        self._file.write(_PATCH_HEADER.pack(*self._header, self.count))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def create_patch(path, writes, source_filename=None):
+    """
+    Writes a patch from (offset, data) pairs, in ascending offset order.
+    """
+    with PatchWriter(path, source_filename) as patch:
+        for offset, data in sorted(writes, key=lambda write: write[0]):
+            patch.write(offset, data)
+    return path
+
+
+def read_patch_header(f):
+    header = f.read(_PATCH_HEADER.size)
+    if len(header) != _PATCH_HEADER.size:
+        raise PatchError("Patch file is truncated")
+    magic, version, source_size, target_size, source_hash, count = _PATCH_HEADER.unpack(header)
+    if magic != PATCH_MAGIC:
+        raise PatchError("Not an SH3 patch file")
+    if version != PATCH_VERSION:
+        raise PatchError(f"Unsupported patch version {version}")
+    return source_size, target_size, source_hash, count
+
+
+def _copy_within(f, source_offset, offset, length):
+    # Copy in chunks; go back to front when the destination overlaps the end of the source
+    if offset > source_offset:
+        position = length
+        while position > 0:
+            size = min(COPY_CHUNK_SIZE, position)
+            position -= size
+            f.seek(source_offset + position)
+            chunk = f.read(size)
+            f.seek(offset + position)
+            f.write(chunk)
+    else:
+        position = 0
+        while position < length:
+            size = min(COPY_CHUNK_SIZE, length - position)
+            f.seek(source_offset + position)
+            chunk = f.read(size)
+            f.seek(offset + position)
+            f.write(chunk)
+            position += size
+
+
+def apply_patch(patch_path, archive_filename, verify=True, progress=None):
+    """
+    Streams a patch onto an archive in place. With verify, the archive must
+    match the size and content hash of the archive the patch was made from.
+    progress(done, total) is called after every operation.
+    """
+    with open(patch_path, "rb") as patch:
+        source_size, target_size, source_hash, count = read_patch_header(patch)
+
+        if verify and source_hash != bytes(16):
+            if (os.path.getsize(archive_filename) != source_size
+                    or bytes.fromhex(content_hash(archive_filename)) != source_hash):
+                raise PatchError(f"{archive_filename} is not the archive this patch was made for")
+
+        with open(archive_filename, "r+b") as f:
+            if target_size > os.path.getsize(archive_filename):
+                f.truncate(target_size)
+
+            for done in range(1, count + 1):
+                op = patch.read(_PATCH_OP.size)
+                if len(op) != _PATCH_OP.size:
+                    raise PatchError("Patch file is truncated")
+                op_type, offset, source_offset, length = _PATCH_OP.unpack(op)
+
+                if op_type == OP_WRITE:
+                    f.seek(offset)
+                    remaining = length
+                    while remaining:
+                        chunk = patch.read(min(COPY_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise PatchError("Patch file is truncated")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                elif op_type == OP_MOVE:
+                    _copy_within(f, source_offset, offset, length)
+                else:
+                    raise PatchError(f"Unknown patch operation {op_type}")
+
+                if progress is not None:
+                    progress(done, count)
+
+            if target_size and target_size < os.path.getsize(archive_filename):
+                f.truncate(target_size)
+
+    print(f"{count} patch operations applied to {archive_filename}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply an SH3 texture patch to a pristine archive.")
+    parser.add_argument("patch", help="Patch file to apply")
+    parser.add_argument("archive", help="Archive to patch in place")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the source archive check")
+    args = parser.parse_args()
+    apply_patch(args.patch, args.archive, verify=not args.no_verify)
+
+
+if __name__ == "__main__":
+    main()
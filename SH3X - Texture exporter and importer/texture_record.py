@@ -0,0 +1,128 @@
+import hashlib
+
+import profiling
+from ps2_palette import decode_palette
+
+# Lightweight texture records shared by the PC, PS2 and analysis code.
+# A Texture holds a texture's metadata and a reference to the archive it came
+# from; the payload (and, for PS2 textures, the palette) is only fetched from
+# the archive when it is accessed. __slots__ keeps each record small when
+# tens of thousands of textures are analysed at once. Item access
+# (texture["width"]) is kept so code written against the old texture dicts
+# keeps working.
+
+
+class Texture:
+    __slots__ = (
+        "index", "width", "height", "bpp", "data_size", "offset", "total_size",
+        "header_offset", "header_size", "filename",
+        # PS2 palette location, None for PC textures
+        "palette_header_offset", "palette_data_offset", "palette_data_size", "bypp", "entry_size",
+        "_data", "_palette", "_reader",
+    )
+
+    def __init__(self, entry, filename, reader, index=None):
+        self.index = entry["index"] if index is None else index
+        self.width = entry["width"]
+        self.height = entry["height"]
+        self.bpp = entry["bpp"]
+        self.data_size = entry["data_size"]
+        self.offset = entry["offset"]
+        self.total_size = entry["total_size"]
+        self.header_offset = entry["header_offset"]
+        self.header_size = entry["header_size"]
+        self.filename = filename
+        self.palette_header_offset = entry.get("palette_header_offset")
+        self.palette_data_offset = entry.get("palette_data_offset")
+        self.palette_data_size = entry.get("palette_data_size")
+        self.bypp = entry.get("bypp")
+        self.entry_size = entry.get("entry_size")
+        self._data = None
+        self._palette = None
+        self._reader = reader
+
+    @property
+    def data(self):
+        """
+        The texture payload. Read from the archive on access (a zero-copy view
+        when the archive is memory-mapped) unless it was loaded or replaced.
+        """
+        if self._data is not None:
+            return self._data
+        return self._reader.view(self.offset, self.data_size)
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def palette_data(self):
+        """
+        The raw PS2 palette blocks as stored in the archive (None once detached by load()).
+        """
+        if self.palette_data_offset is None or self._reader is None:
+            return None
+        return self._reader.read(self.palette_data_offset, self.palette_data_size)
+
+    @property
+    def palette(self):
+        """
+        The processed PS2 palette as a (colors, 4) uint8 array of RGBA, decoded on
+        first access.
+        """
+        if self._palette is None and self.palette_data_offset is not None:
+            with profiling.stage("palette", bytes_decoded=self.palette_data_size):
+                self._palette = decode_palette(self.palette_data, self.palette_data_size,
+                                               self.entry_size, self.bypp)
+        return self._palette
+
+    @palette.setter
+    def palette(self, value):
+        self._palette = value
+
+    @property
+    def palette_header_info(self):
+        return (self.palette_data_size, self.bypp)
+
+    def content_key(self):
+        """
+        Hashes the texture's dimensions, payload and (for PS2 textures) palette.
+        Textures with the same key decode to the same image.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.width}x{self.height}x{self.bpp}".encode())
+        digest.update(self.data)
+        if self.palette is not None:
+            digest.update(self.palette)
+        return digest.hexdigest()
+
+    def load(self):
+        """
+        Copies the payload (and palette) out of the archive so the texture no
+        longer depends on it.
+        """
+        if self._data is None:
+            self._data = self._reader.read(self.offset, self.data_size)
+        self._palette = self.palette
+        self._reader = None
+        return self._data
+
+    def close_archive(self):
+        """
+        Closes the archive the texture reads from (it is opened again if a
+        texture of it is accessed later).
+        """
+        if self._reader is not None:
+            self._reader.close()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return f"<Texture {self.filename} {self.width}x{self.height} {self.bpp}bpp at {self.offset:#x}>"
@@ -0,0 +1,231 @@
+import os
+import queue
+import threading
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+from atomic_io import atomic_save_image
+from image_cache import ImageCache
+from texture_index import get_cache_root
+
+# Thumbnail grid browser for archives with thousands of textures.
+# Only the cells inside the visible part of the canvas exist at any time; cells
+# that scroll out of view are deleted again. Thumbnails are made on a
+# background thread by downsampling the decoded texture, and cached in memory
+# and on disk under the hash of the texture's content, so the same texture is
+# only ever decoded once.
+
+THUMBNAIL_SIZE = 128
+CELL_PADDING = 8
+LABEL_HEIGHT = 16
+CELL_WIDTH = THUMBNAIL_SIZE + CELL_PADDING
+CELL_HEIGHT = THUMBNAIL_SIZE + CELL_PADDING + LABEL_HEIGHT
+
+MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def get_thumbnail_dir():
+    return os.path.join(get_cache_root(), "thumbnails")
+
+
+def make_thumbnail(img, size=THUMBNAIL_SIZE):
+    """
+    Downsamples an image to fit in a size x size box. Large images are first
+    shrunk by an integer factor with a cheap box reduce.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    factor = max(1, min(img.width, img.height) // (size * 2))
+    if factor > 1:
+        img = img.reduce(factor)
+    img = img.copy()
+    img.thumbnail((size, size), Image.BILINEAR)
+    return img
+
+
+class ThumbnailCache:
+    """
+    Memory LRU plus on-disk PNG cache of thumbnails, keyed by content hash.
+    """
+
+    def __init__(self, decode, cache_dir=None, max_bytes=MEMORY_CACHE_BYTES):
+        self.decode = decode
+        self.cache_dir = cache_dir if cache_dir is not None else get_thumbnail_dir()
+        self.memory = ImageCache(max_bytes)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def get(self, texture):
+        key = texture.content_key()
+        img = self.memory.get(key)
+        if img is not None:
+            return img
+
+        path = self._path(key)
+        try:
+            with Image.open(path) as cached:
+                img = cached.copy()
+        except (OSError, ValueError):
+            img = make_thumbnail(self.decode(texture))
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                atomic_save_image(img, path, compress_level=1)
+            except OSError as e:
+                print(f"Could not cache thumbnail {path}: {e}")
+        self.memory.put(key, img)
+        return img
+
+
+class ThumbnailGrid:
+    """
+    Window showing textures as a scrollable grid of thumbnails. textures may
+    still be filled by a BackgroundScan (scan), in which case the grid grows
+    as textures are found. Clicking a thumbnail calls open_texture(index).
+    """
+
+    def __init__(self, textures, decode, open_texture=None, scan=None, title="Texture Browser"):
+        self.textures = textures
+        self.scan = scan
+        self.open_texture = open_texture
+        self.thumbnails = ThumbnailCache(decode)
+
+        self.window = tk.Toplevel()
+        self.window.title(title)
+        self.window.geometry(f"{CELL_WIDTH * 6 + 40}x{CELL_HEIGHT * 4}")
+
+        self.status = tk.Label(self.window, anchor="w")
+        self.status.pack(side=tk.BOTTOM, fill=tk.X)
+        self.scrollbar = tk.Scrollbar(self.window, orient=tk.VERTICAL)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(self.window, yscrollcommand=self._on_scroll, background="#202020")
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.config(command=self.canvas.yview)
+
+        # index -> PhotoImage (None until its thumbnail arrives) of the cells that currently exist
+        self.cells = {}
+        self.columns = 0
+        self.count = 0
+
+        # Thumbnail requests go to a worker thread, finished thumbnails come back through a queue
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._visible = set()
+        self._closed = False
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+        self.canvas.bind("<Configure>", lambda event: self.refresh())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda event: self._scroll(-event.delta // 120))
+        self.canvas.bind("<Button-4>", lambda event: self._scroll(-1))
+        self.canvas.bind("<Button-5>", lambda event: self._scroll(1))
+        self.window.bind("<Destroy>", self._on_destroy)
+
+        self._poll()
+
+    def _scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self.refresh()
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def _on_destroy(self, event):
+        if event.widget is self.window:
+            self._closed = True
+            self._requests.put(None)
+            if self.scan is not None:
+                self.scan.close()
+
+    def _on_click(self, event):
+        if self.columns == 0 or self.open_texture is None:
+            return
+        column = int(self.canvas.canvasx(event.x)) // CELL_WIDTH
+        row = int(self.canvas.canvasy(event.y)) // CELL_HEIGHT
+        index = row * self.columns + column
+        if column < self.columns and index < len(self.textures):
+            self.open_texture(index)
+
+    def refresh(self):
+        """
+        Creates the cells that scrolled into view and deletes those that scrolled out.
+        """
+        if self._closed:
+            return
+        width = max(self.canvas.winfo_width(), CELL_WIDTH)
+        columns = max(1, width // CELL_WIDTH)
+        count = len(self.textures)
+        if columns != self.columns:
+            # The layout changed, every cell moves
+            self.canvas.delete("cell")
+            self.cells.clear()
+            self.columns = columns
+        if count != self.count or not self.cells:
+            self.count = count
+            rows = (count + columns - 1) // columns
+            self.canvas.config(scrollregion=(0, 0, columns * CELL_WIDTH, rows * CELL_HEIGHT))
+
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top) // CELL_HEIGHT)
+        last_row = int(bottom) // CELL_HEIGHT
+        visible = set(range(first_row * columns, min(count, (last_row + 1) * columns)))
+        # Published before any request is queued, since the worker drops requests for cells not in it
+        self._visible = visible
+
+        for index in list(self.cells):
+            if index not in visible:
+                self.canvas.delete(f"cell{index}")
+                del self.cells[index]
+        for index in sorted(visible - set(self.cells)):
+            self._create_cell(index)
+
+    def _create_cell(self, index):
+        texture = self.textures[index]
+        x = (index % self.columns) * CELL_WIDTH + CELL_WIDTH // 2
+        y = (index // self.columns) * CELL_HEIGHT + CELL_PADDING // 2
+        tags = ("cell", f"cell{index}")
+        self.canvas.create_rectangle(x - THUMBNAIL_SIZE // 2, y, x + THUMBNAIL_SIZE // 2, y + THUMBNAIL_SIZE,
+                                     outline="#404040", tags=tags)
+        self.canvas.create_image(x, y + THUMBNAIL_SIZE // 2, tags=tags + (f"image{index}",))
+        self.canvas.create_text(x, y + THUMBNAIL_SIZE + LABEL_HEIGHT // 2, fill="#c0c0c0",
+                                text=f"{texture.width}x{texture.height}", tags=tags)
+        self.cells[index] = None
+        self._requests.put(index)
+
+    def _work(self):
+        while True:
+            index = self._requests.get()
+            if index is None or self._closed:
+                return
+            # Skip cells that scrolled out of view before their turn came
+            if index not in self._visible:
+                continue
+            try:
+                self._results.put((index, self.thumbnails.get(self.textures[index])))
+            except Exception as e:
+                print(f"Could not make a thumbnail for texture {index}: {e}")
+
+    def _poll(self):
+        if self._closed:
+            return
+        while True:
+            try:
+                index, img = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if index in self.cells:
+                photo = ImageTk.PhotoImage(img)
+                self.cells[index] = photo  # Keep a reference to prevent garbage collection
+                self.canvas.itemconfig(f"image{index}", image=photo)
+
+        if self.scan is not None:
+            self.status.config(text=self.scan.status())
+        else:
+            self.status.config(text=f"{len(self.textures)} textures")
+        if len(self.textures) != self.count:
+            self.refresh()
+        self.window.after(30, self._poll)